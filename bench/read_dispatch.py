@@ -0,0 +1,97 @@
+"""Measure how fast Connection.read works through a large batch of events from one receive.
+
+Each scenario's batch of server frames is recorded once (from a fresh nh2.mock.MockServer), then
+replayed into fresh connections that are in the same state, and just the read that handles it is
+timed. The median per batch and per event are reported, along with what the client wrote back:
+
+    python bench/read_dispatch.py [runs]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import anyio
+import h2.settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nh2.mock  # pylint: disable=wrong-import-position
+
+
+async def _download(mock_server, unused_conn, streams):
+    for stream_id in streams:
+        mock_server.c.send_headers(stream_id, [(':status', '200')])
+        for _ in range(40):
+            mock_server.c.send_data(stream_id, b'x' * 16)
+        mock_server.c.end_stream(stream_id)
+
+
+async def _upload(mock_server, unused_conn, streams):
+    # Every stream's window started at 0, and opens up 50 bytes at a time.
+    mock_server.c.increment_flow_control_window(len(streams) * 1000)
+    for stream_id in streams:
+        for _ in range(20):
+            mock_server.c.increment_flow_control_window(50, stream_id=stream_id)
+
+
+SCENARIOS = {
+    # name: (batch builder, request method, request body, server settings, number of streams)
+    'download 100x40 frames': (_download, 'GET', None, None, 100),
+    'upload 50x20 window updates': (_upload, 'POST', bytes(1000), {
+        h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: 0
+    }, 50),
+}
+
+
+async def _prepare(method, body, settings, count):
+    """Return a (mock_server, conn, stream IDs) whose streams are waiting on their responses."""
+
+    async with nh2.mock.expect_connect('example.com', 443, settings=settings) as mock_server:
+        conn = await nh2.mock.MockConnection('example.com', 443)
+    await mock_server.read()
+    await conn.read()  # The server's settings.
+    await conn.read()  # The server's acknowledgment of the client's settings.
+    streams = []
+    for _ in range(count):
+        streams.append((await conn.request(method, '/', body=body)).stream_id)
+    while len(mock_server.c.streams) < count:
+        await mock_server.read()
+    mock_server.get_client_stats()
+    return mock_server, conn, streams
+
+
+async def _run(name, runs):
+    build, *setup = SCENARIOS[name]
+
+    mock_server, conn, streams = await _prepare(*setup)
+    await build(mock_server, conn, streams)
+    batch = mock_server.c.data_to_send()
+
+    timings = []
+    for _ in range(runs):
+        mock_server, conn, streams = await _prepare(*setup)
+        await mock_server.s.send(batch)
+        start = time.perf_counter()
+        await conn.read()
+        timings.append(time.perf_counter() - start)
+    events = len(mock_server.client_events[-1])
+    median = statistics.median(timings)
+    print(f'{name}: {events} events, {median * 1000:.2f} ms/batch, '
+          f'{median / events * 1e6:.2f} us/event')
+    # Just the totals (not the per-stream breakdown).
+    for line in mock_server.get_client_stats().splitlines()[:2]:
+        print(f'    {line}')
+
+
+def main():
+    """Run each scenario, and report the medians."""
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for name in SCENARIOS:
+        anyio.run(_run, name, runs)
+
+
+if __name__ == '__main__':
+    main()
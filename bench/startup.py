@@ -0,0 +1,72 @@
+"""Measure nh2's startup costs: import time, first-connection setup, and first-request latency.
+
+Each sample runs in a fresh interpreter (so nothing is already imported or cached), and the median
+of each phase is reported in milliseconds:
+
+    python bench/startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ('import nh2.connection', 'ssl context', 'first request')
+
+
+def child():
+    """Run (and time) each phase once, printing the timings."""
+
+    start = time.perf_counter()
+    import nh2.connection  # pylint: disable=import-outside-toplevel
+    imported = time.perf_counter()
+    nh2.connection._ssl_context()  # pylint: disable=protected-access
+    ssl_ready = time.perf_counter()
+
+    import anyio  # pylint: disable=import-outside-toplevel
+
+    async def first_request():
+        # nh2.mock stands in for the network, so this is nh2's own cost (including importing h2) of
+        # setting up a connection and completing a request on it.
+        started = time.perf_counter()
+        import nh2.mock  # pylint: disable=import-outside-toplevel
+
+        async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+            conn = await nh2.mock.MockConnection('example.com', 443)
+        stream = await conn.request('GET', '/')
+        await mock_server.read()
+        await mock_server.read()
+        mock_server.c.send_headers(1, [(':status', '200')], end_stream=True)
+        await mock_server.flush()
+        await stream.wait()
+        return time.perf_counter() - started
+
+    request = anyio.run(first_request)
+    print(imported - start, ssl_ready - imported, request)
+
+
+def main():
+    """Collect samples from fresh interpreters and report the medians."""
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get('PYTHONPATH')))))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, __file__, '--child'],
+                                capture_output=True,
+                                check=True,
+                                env=env,
+                                text=True).stdout
+        samples.append([float(value) for value in output.split()])
+    for phase, values in zip(PHASES, zip(*samples)):
+        print(f'{phase:>24}: {statistics.median(values) * 1000:7.2f} ms')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--child']:
+        child()
+    else:
+        main()
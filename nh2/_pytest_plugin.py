@@ -2,10 +2,12 @@
 
 import pytest
 
-import nh2.mock
-
 
 @pytest.fixture(autouse=True)
 def _connection_mock(monkeypatch):
+    # Importing nh2.mock (and so h2) is deferred until a test actually runs, so merely having nh2
+    # installed doesn't slow down every pytest session's startup.
+    import nh2.mock  # pylint: disable=import-outside-toplevel
+
     monkeypatch.setattr('nh2.connection.Connection', nh2.mock.MockConnection)
     monkeypatch.setattr('nh2.mock._servers', {})  # Don't let a failing test poison other tests.
@@ -21,21 +21,27 @@ def create_pipe():
 
 
 class _Future:
+    # The Event is only created if someone actually waits before the value is set, so futures that
+    # are never awaited (or are awaited after they're done) cost no more than this object.
+    done = False
+    event = None
     value = None
 
-    def __init__(self):
-        self.event = anyio.Event()
-
     def set_value(self, value):
         """Cause any tasks running x = await self.wait() to resume (with x = value)."""
 
         self.value = value
-        self.event.set()
+        self.done = True
+        if self.event:
+            self.event.set()
 
     async def wait(self):
         """Wait for self.set_value(x) to be called, then return x."""
 
-        await self.event.wait()
+        if not self.done:
+            if not self.event:
+                self.event = anyio.Event()
+            await self.event.wait()
         return self.value
 
     def __await__(self):
@@ -46,6 +52,7 @@ class _TaskGroupWrapper:
 
     def __init__(self, tg):
         self.tg = tg
+        self.cancel_scope = tg.cancel_scope
 
     def start_soon(self, func, *args, **kwargs):
         """Schedule func(*args) to run soon. Await this to get func()'s return value."""
@@ -66,3 +73,93 @@ async def create_task_group():
 
     async with anyio.create_task_group() as tg:
         yield _TaskGroupWrapper(tg)
+
+
+@contextlib.asynccontextmanager
+async def as_completed(func, items, *, limit):
+    """Run func(item) for each item, at most limit at a time, yielding a stream of results.
+
+    The yielded object is an async iterator of (item, func(item)) pairs in the order they finish.
+    Items are pulled from the (possibly lazy) iterable only as workers free up, and at most limit
+    results are buffered before workers pause to let the caller catch up. If any func(item) raises
+    an exception, the remaining work is cancelled and the exception propagates (wrapped in nested
+    ExceptionGroups); leaving the context early also cancels any outstanding work.
+    """
+
+    send, receive = anyio.create_memory_object_stream(limit)
+    items = iter(items)
+
+    async def worker():
+        for item in items:
+            await send.send((item, await func(item)))
+
+    async def run_workers():
+        async with send, create_task_group() as workers:
+            for _ in range(limit):
+                workers.start_soon(worker)
+
+    async with receive, create_task_group() as tg:
+        tg.start_soon(run_workers)
+        try:
+            yield receive
+        finally:
+            tg.cancel_scope.cancel()
+
+
+_DONE = object()
+
+
+class _InOrder:
+    """An async iterator of the results of a map_concurrent, in input order."""
+
+    def __init__(self, futures, slots):
+        self.futures = futures
+        self.slots = slots
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            future = await self.futures.receive()
+        except anyio.EndOfStream:
+            raise StopAsyncIteration from None
+        result = await future
+        # Only now that the result has been handed over may another item be started.
+        self.slots.release()
+        return result
+
+
+@contextlib.asynccontextmanager
+async def map_concurrent(func, items, *, limit):
+    """Run func(item) for each item, at most limit at a time, yielding a stream of results.
+
+    The yielded object is an async iterator of func(item) in the same order as items. Each item
+    holds one of limit slots from when it's started until its result is consumed, so a slow item
+    holds back later ones rather than letting their results pile up: no more than limit results are
+    ever running or waiting to be consumed. Items are pulled from the (possibly lazy) iterable only
+    as slots free up.
+
+    If any func(item) raises an exception, the remaining work is cancelled and the exception
+    propagates out of the context, wrapped in (nested) ExceptionGroups; leaving the context early
+    also cancels any outstanding work.
+    """
+
+    slots = anyio.Semaphore(limit)
+    send, receive = anyio.create_memory_object_stream(limit)
+
+    async def run_all():
+        async with send, create_task_group() as workers:
+            iterator = iter(items)
+            while True:
+                await slots.acquire()  # Before pulling the next item, not just before starting it.
+                if (item := next(iterator, _DONE)) is _DONE:
+                    break
+                await send.send(workers.start_soon(func, item))
+
+    async with receive, create_task_group() as tg:
+        tg.start_soon(run_all)
+        try:
+            yield _InOrder(receive, slots)
+        finally:
+            tg.cancel_scope.cancel()
@@ -1,31 +1,106 @@
 """An HTTP/2 client connection."""
 
-import ssl
+import functools
+import importlib
 
 import anyio
-import certifi
-import h2.config
-import h2.connection
-import h2.events
 
 import nh2.rex
+import nh2.sink
 
-ctx = ssl.create_default_context(cafile=certifi.where())
-ctx.set_alpn_protocols(['h2'])
 
+class _LazyPackage:
+    """A stand-in for a package whose submodules are only imported once they're first used."""
 
-class Connection:
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        module = importlib.import_module(f'{self._name}.{name}')
+        setattr(self, name, module)
+        return module
+
+
+# h2 takes about as long to import as everything else here combined, so it isn't imported until a
+# Connection is actually created.
+h2 = _LazyPackage('h2')
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context():
+    # Loading certifi's CA bundle is the single most expensive part of setting up nh2, so it's done
+    # the first time a connection is opened (and then reused).
+    import ssl  # pylint: disable=import-outside-toplevel
+    import certifi  # pylint: disable=import-outside-toplevel
+
+    ctx = ssl.create_default_context(cafile=certifi.where())
+    ctx.set_alpn_protocols(['h2'])
+    return ctx
+
+
+def __getattr__(name):
+    # nh2.connection.ctx used to be created at import time. It's still the context every connection
+    # uses (so it can still be customized, like to trust extra CAs), just created on first access.
+    if name == 'ctx':
+        return _ssl_context()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# Responses that mean the server is shedding load (and so the client should back off).
+_OVERLOADED_STATUSES = (429, 503)
+
+# Data that a stream is holding back (see Stream.iter_data) is still returned to the connection's
+# window once this much has accumulated: a quarter of the default window, so the window never fills.
+_CONNECTION_CREDIT_THRESHOLD = 16384
+
+
+class StreamResetError(Exception):
+    """The server reset a stream before sending a complete response."""
+
+    def __init__(self, error_code):
+        super().__init__(error_code)
+        self.error_code = error_code
+
+
+class StreamEndedError(Exception):
+    """The server finished its response before the request had been completely sent."""
+
+    def __init__(self, response):
+        super().__init__(response.status)
+        self.response = response
+
+
+class ExtendedConnectUnsupported(Exception):
+    """The server didn't advertise SETTINGS_ENABLE_CONNECT_PROTOCOL (RFC 8441)."""
+
+
+class _Batch:
+    """What one Connection.read's events add up to, applied once they've all been handled."""
+
+    def __init__(self):
+        self.acknowledge = {}  # {stream_id: flow-controlled bytes to acknowledge}
+        self.connection_credit = 0  # Bytes acknowledged to the connection but not their streams.
+        self.resume = {}  # {stream_id: Stream whose window opened up}
+        self.resume_all = False  # The connection's window opened up, so any stream may send more.
+        self.wake = {}  # {stream_id: Stream with something new for its waiters}
+
+
+class Connection:  # pylint: disable=too-many-instance-attributes
     """An HTTP/2 client connection."""
 
-    async def __new__(cls, host, port):  # pylint: disable=invalid-overridden-method
+    async def __new__(cls, host, port, *, limiter=None):  # pylint: disable=invalid-overridden-method
         self = super().__new__(cls)
-        await self.__init__(host, port)
+        await self.__init__(host, port, limiter=limiter)
         return self
 
-    async def __init__(self, host, port):
+    async def __init__(self, host, port, *, limiter=None):
         self.host = host
+        self.limiter = limiter
         self.running = False
         self.streams = {}
+        self.settings_received = False
+        self.connection_credit = 0
+        self.settings_event = None
         self._h2_lock = anyio.Lock(fast_acquire=True)
 
         self.s = await self._connect(host, port)
@@ -35,22 +110,145 @@ class Connection:
         self.c.initiate_connection()
         await self.flush()
 
+        # Events of any other type (like PingReceived or SettingsAcknowledged) need nothing from us.
+        self._handlers = {
+            h2.events.DataReceived: self._data_received,
+            h2.events.ResponseReceived: self._response_received,
+            h2.events.TrailersReceived: self._trailers_received,
+            h2.events.WindowUpdated: self._window_updated,
+            h2.events.StreamEnded: self._stream_ended,
+            h2.events.StreamReset: self._stream_reset,
+            h2.events.RemoteSettingsChanged: self._remote_settings_changed,
+        }
+
     async def _connect(self, host, port):
-        return await anyio.connect_tcp(host, port, ssl_context=ctx, tls_standard_compatible=False)
+        return await anyio.connect_tcp(host,
+                                       port,
+                                       ssl_context=_ssl_context(),
+                                       tls_standard_compatible=False)
 
-    async def request(self, method, path, *, headers=(), body=None, json=None):  # pylint: disable=too-many-arguments
+    async def request(self, method, path, *, headers=(), body=None, json=None, sink=None):  # pylint: disable=too-many-arguments
         """Send a method request for path."""
 
-        return await self.send(
-            nh2.rex.Request(method, self.host, path, headers=headers, body=body, json=json))
+        return await self.send(nh2.rex.Request(method,
+                                               self.host,
+                                               path,
+                                               headers=headers,
+                                               body=body,
+                                               json=json),
+                               sink=sink)
+
+    async def send(self, request, *, end_stream=True, sink=None):
+        """Send the given Request (after waiting for self.limiter to let it through).
+
+        If end_stream is False, the request side of the stream is left open after request.body is
+        sent, so more can be sent with Stream.write (until Stream.end is called). Such a stream only
+        counts against self.limiter until the response's headers arrive.
 
-    async def send(self, request):
-        """Send the given Request."""
+        If sink is given (a bytearray or binary file), the response's body is written straight into
+        it as it arrives, and becomes the Response's body (see Stream.read_into).
+        """
+
+        if self.limiter:
+            await self.limiter.acquire(request)
+        sent = False
+        try:
+            async with self._h2_lock:
+                # Once h2 has encoded the request's headers, they have to actually be sent (or the
+                # connection's HPACK state is corrupted), and the stream has to be tracked (so it
+                # can be reset). So only the waits for the limiter and the lock can be cancelled.
+                with anyio.CancelScope(shield=True):
+                    stream_id = self.c.get_next_available_stream_id()
+                    self.streams[stream_id] = stream = await Stream(self,
+                                                                    stream_id,
+                                                                    request,
+                                                                    end_stream=end_stream,
+                                                                    sink=sink)
+                    stream.limited = self.limiter is not None
+                    sent = True
+                return stream
+        finally:
+            if self.limiter and not sent:
+                self.limiter.discard()
+
+    async def connect(self, protocol, path, *, headers=()):
+        """Open a stream tunneling protocol (like 'websocket') to path, using extended CONNECT.
+
+        The returned Stream is left open in both directions once the server accepts it (see
+        Stream.wait_headers); raises ExtendedConnectUnsupported if the server doesn't allow it.
+        """
+
+        await self.wait_settings()
+        if not self.c.remote_settings.enable_connect_protocol:
+            raise ExtendedConnectUnsupported(self.host)
+        # :protocol is a pseudo-header, so it has to come before any regular headers.
+        request = nh2.rex.Request('CONNECT',
+                                  self.host,
+                                  path,
+                                  headers={
+                                      ':protocol': protocol,
+                                      **dict(headers)
+                                  })
+        return await self.send(request, end_stream=False)
+
+    async def wait_settings(self):
+        """Wait until the server's first SETTINGS arrive (running the loop if nobody else is)."""
+
+        while not self.settings_received:
+            if self.running:
+                if not self.settings_event:
+                    self.settings_event = anyio.Event()
+                await self.settings_event.wait()
+            else:
+                self.running = True
+                try:
+                    while not self.settings_received:
+                        await self.read()
+                finally:
+                    self.running = False
+                    self.wake_waiters()
+
+    def wake_waiters(self):
+        """Wake every task waiting on the connection (so one of them can take over running it)."""
+
+        if self.settings_event:
+            self.settings_event.set()
+            self.settings_event = None
+        for stream in self.streams.values():
+            stream.wake()
+
+    async def resume(self, stream):
+        """Send as much of stream's pending body as its window allows."""
+
+        async with self._h2_lock:
+            await stream.send_body()
+
+    async def acknowledge(self, stream, length):
+        """Tell the server length bytes of stream's data were consumed, so it can send more.
+
+        This only reopens stream's own window: the connection's share of that data was returned as
+        soon as it arrived (so a slow consumer of one stream doesn't stall every other stream).
+        """
 
         async with self._h2_lock:
-            stream_id = self.c.get_next_available_stream_id()
-            self.streams[stream_id] = stream = await Stream(self, stream_id, request)
-            return stream
+            # Once a stream has ended (or been reset), there's nothing more for it to be sent.
+            if stream.stream_id in self.streams:
+                self.c.increment_flow_control_window(length, stream_id=stream.stream_id)
+                await self.flush()
+
+    async def cancel(self, stream):
+        """Reset stream (if it hasn't already ended), telling the server to stop sending it."""
+
+        async with self._h2_lock:
+            if self.streams.pop(stream.stream_id, None) is None:
+                return
+            self.c.reset_stream(stream.stream_id, error_code=h2.errors.ErrorCodes.CANCEL)
+            await self.flush()
+        stream.reset(h2.errors.ErrorCodes.CANCEL)
+        stream.wake()
+        if stream.limited:
+            stream.limited = False
+            self.limiter.discard()
 
     async def read(self):
         """Wait until data is available."""
@@ -61,23 +259,90 @@ class Connection:
             return
 
         async with self._h2_lock:
+            # One receive can carry thousands of events, so each is just recorded into the batch,
+            # and acknowledgements, resumed sends, and wakeups happen once per stream afterwards.
+            batch = _Batch()
+            handlers = self._handlers
             for event in self._receive_data(data):
-                if isinstance(event, h2.events.DataReceived):
-                    # Update flow control so the server doesn't starve us.
-                    self.c.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
-                    stream = self.streams[event.stream_id]
-                    stream.receive_data(event.data)
-                elif isinstance(event, h2.events.ResponseReceived):
-                    stream = self.streams[event.stream_id]
-                    stream.receive_headers(event.headers)
-                elif isinstance(event, h2.events.WindowUpdated):
-                    if event.stream_id:
-                        stream = self.streams[event.stream_id]
-                        await stream.send_body()
-                elif isinstance(event, h2.events.StreamEnded):
-                    stream = self.streams.pop(event.stream_id)
-                    stream.ended()
+                if (handler := handlers.get(type(event))):
+                    handler(event, batch)
+
+            for stream_id, length in batch.acknowledge.items():
+                self.c.acknowledge_received_data(length, stream_id)
+            # Like h2 does for acknowledge_received_data, only announce this once it has added up
+            # (so a stream of small messages doesn't cost a WINDOW_UPDATE each).
+            self.connection_credit += batch.connection_credit
+            if self.connection_credit >= _CONNECTION_CREDIT_THRESHOLD:
+                self.c.increment_flow_control_window(self.connection_credit)
+                self.connection_credit = 0
+            resume = self.streams.values() if batch.resume_all else batch.resume.values()
+            for stream in list(resume):
+                # Streams that ended (or were reset) later in the batch have nothing left to send.
+                if stream.stream_id in self.streams:
+                    await stream.send_body(flush=False)
             await self.flush()
+            for stream in batch.wake.values():
+                stream.wake()
+
+    # Events for streams that aren't in self.streams (because they were cancelled, or reset, or were
+    # never ours) are tolerated, with any data they carried still acknowledged.
+
+    def _data_received(self, event, batch):
+        length = event.flow_controlled_length
+        if (stream := self.streams.get(event.stream_id)):
+            acknowledged = stream.receive_data(event.data, length)
+            batch.connection_credit += length - acknowledged
+            length = acknowledged
+            if stream.streaming:
+                batch.wake[event.stream_id] = stream
+        if length:
+            batch.acknowledge[event.stream_id] = batch.acknowledge.get(event.stream_id, 0) + length
+
+    def _response_received(self, event, batch):
+        if (stream := self.streams.get(event.stream_id)):
+            stream.receive_headers(event.headers)
+            if not stream.closing:
+                # A tunnel (or other stream left open by send(end_stream=False)) may last as long as
+                # the connection, so it only counts against the limiter until it's answered.
+                overloaded = int(stream.received_headers[':status']) in _OVERLOADED_STATUSES
+                self._finished(stream, overloaded)
+            batch.wake[event.stream_id] = stream
+
+    def _trailers_received(self, event, unused_batch):
+        if (stream := self.streams.get(event.stream_id)):
+            stream.receive_trailers(event.headers)
+
+    def _window_updated(self, event, batch):
+        if not event.stream_id:
+            batch.resume_all = True
+        elif (stream := self.streams.get(event.stream_id)):
+            batch.resume[event.stream_id] = stream
+
+    def _stream_ended(self, event, batch):
+        if (stream := self.streams.pop(event.stream_id, None)):
+            stream.ended()
+            self._finished(stream, stream.value.status in _OVERLOADED_STATUSES)
+            batch.wake[event.stream_id] = stream
+
+    def _stream_reset(self, event, batch):
+        if (stream := self.streams.pop(event.stream_id, None)):
+            stream.reset(event.error_code)
+            # Like the _OVERLOADED_STATUSES, these mean the server is shedding load.
+            overloaded = event.error_code in (h2.errors.ErrorCodes.REFUSED_STREAM,
+                                              h2.errors.ErrorCodes.ENHANCE_YOUR_CALM)
+            self._finished(stream, overloaded)
+            batch.wake[event.stream_id] = stream
+
+    def _remote_settings_changed(self, unused_event, unused_batch):
+        self.settings_received = True
+        if self.settings_event:
+            self.settings_event.set()
+            self.settings_event = None
+
+    def _finished(self, stream, dropped):
+        if stream.limited:
+            stream.limited = False
+            self.limiter.release(anyio.current_time() - stream.started, dropped=dropped)
 
     def _receive_data(self, data):
         return self.c.receive_data(data)
@@ -100,82 +365,282 @@ class Connection:
 class Stream:  # pylint: disable=too-many-instance-attributes
     """A Request that's been sent over a Connection that hasn't received a StreamEnded yet."""
 
-    async def __new__(cls, connection, stream_id, request):  # pylint: disable=invalid-overridden-method
+    async def __new__(cls, connection, stream_id, request, *, end_stream=True, sink=None):  # pylint: disable=invalid-overridden-method
         self = super().__new__(cls)
-        await self.__init__(connection, stream_id, request)
+        await self.__init__(connection, stream_id, request, end_stream=end_stream, sink=sink)
         return self
 
-    async def __init__(self, connection, stream_id, request):
+    async def __init__(self, connection, stream_id, request, *, end_stream=True, sink=None):
         self.connection = connection
         self.stream_id = stream_id
         self.request = request
         self.received_headers = None
+        self.received_trailers = None
         self.received_data = []
-        self.tosend = request.body
+        self.streaming = False
+        self.unacknowledged = 0
+        self.sinking = sink is not None
+        self.sink_target = sink
+        self.sink = None
+        if hasattr(request.body, 'read'):
+            self.tosend = b''
+            self.reader = request.body
+        else:
+            self.tosend = request.body
+            self.reader = None
+        self.trailers = request.trailers
+        self.closing = end_stream
+        # Whether the stream still holds a slot from connection.limiter (set by Connection.send).
+        self.limited = False
+        self.closed = False
+        self.started = anyio.current_time()
         self.event = None
         self.value = None
+        self.error = None
         await self.send_headers()
         await self.send_body()
 
     async def send_headers(self):
         """Send the request's headers."""
 
-        end_stream = not self.tosend
+        has_body = self.tosend or self.reader
+        end_stream = self.closed = self.closing and not has_body and not self.trailers
         self.connection.c.send_headers(self.stream_id,
                                        self.request.headers.items(),
                                        end_stream=end_stream)
-        if end_stream:
+        if not has_body:
             await self.connection.flush()
 
-    async def send_body(self):
-        """Send as much of the request's body as the stream's window allows."""
+    async def send_body(self, *, flush=True):
+        """Send as much of the request's body as the stream's window allows (then any trailers).
+
+        With flush=False, the frames are left for the caller to flush (like Connection.read does
+        once for all the streams it resumes).
+        """
 
-        while self.tosend and (window := self.connection.c.local_flow_control_window(
-                self.stream_id)):
+        while self.tosend or self.reader:
+            if not (window := self.connection.c.local_flow_control_window(self.stream_id)):
+                break
             limit = min(window, self.connection.c.max_outbound_frame_size)
+            if self.reader and len(self.tosend) <= limit:
+                # Read one byte past what will fit, to know whether this frame ends the stream.
+                if (data := self.reader.read(limit + 1 - len(self.tosend))):
+                    self.tosend += data
+                else:
+                    self.reader = None
             data = self.tosend[:limit]
             self.tosend = self.tosend[limit:]
-            self.connection.c.send_data(self.stream_id, data, end_stream=not self.tosend)
+            end_stream = self.closed = (self.closing and not self.tosend and not self.reader and
+                                        not self.trailers)
+            self.connection.c.send_data(self.stream_id, data, end_stream=end_stream)
+            if flush:
+                await self.connection.flush()
+
+        drained = not self.tosend and not self.reader
+        if drained and self.closing and not self.closed:
+            self.closed = True
+            if self.trailers:
+                self.connection.c.send_headers(self.stream_id,
+                                               self.trailers.items(),
+                                               end_stream=True)
+            else:
+                self.connection.c.end_stream(self.stream_id)
+        if flush:
+            # Even if the window is closed, the headers (if nothing else) may still need to go out.
             await self.connection.flush()
+        if drained and not self.closing:
+            # Let Stream.write know everything it was waiting to send has been sent.
+            self.wake()
+
+    async def write(self, data):
+        """Send data, waiting until it has all fit through the flow-control window.
+
+        The stream must have been sent with end_stream=False, and not ended yet.
+        """
+
+        assert not self.closing
+        self._check_writable()
+        self.tosend += data
+        await self.connection.resume(self)
+        await self._run_until(lambda: not self.tosend or self.value or self.error)
+        self._check_writable()
+
+    def _check_writable(self):
+        if self.error:
+            raise self.error
+        if self.value:
+            # The server already sent its complete response (like an early 413, or a gRPC error
+            # status), so nothing will ever make room for the rest of the request.
+            self.tosend = b''
+            raise StreamEndedError(self._result())
+
+    async def end(self, trailers=None):
+        """Finish sending the request (after any pending data), with trailers if given."""
+
+        assert not self.closing
+        if trailers is not None:
+            self.trailers = dict(trailers)
+        self.closing = True
+        await self.connection.resume(self)
 
     def receive_headers(self, headers):
         """Store headers received by a ResponseReceived."""
 
         self.received_headers = dict(headers)
 
-    def receive_data(self, data):
-        """Store data received by a DataReceived."""
+    def receive_trailers(self, headers):
+        """Store trailers received by a TrailersReceived."""
 
+        self.received_trailers = dict(headers)
+
+    def receive_data(self, data, flow_controlled_length):
+        """Store data received by a DataReceived. Return how much to acknowledge right away."""
+
+        if self.sinking:
+            if not self.sink:
+                self._open_sink()
+            self.sink.write(data)
+            return flow_controlled_length
         self.received_data.append(data)
+        if self.streaming:
+            # Leave the data unacknowledged until iter_data's caller actually consumes it, so a slow
+            # consumer makes the server stop sending (rather than making us buffer without limit).
+            self.unacknowledged += flow_controlled_length
+            return 0
+        # Update flow control so the server doesn't starve us.
+        return flow_controlled_length
 
     def ended(self):
         """Mark the request as being finalized."""
 
-        self.value = nh2.rex.Response(self.request, self.received_headers,
-                                      b''.join(self.received_data).decode('utf8'))
+        # If the body was consumed through iter_data, it isn't also collected into the Response.
+        if self.sinking:
+            if not self.sink:
+                self._open_sink()
+            body = self.sink.close()
+        elif self.streaming:
+            body = ''
+        else:
+            # This is decoded by _result, in the task that asks for it: a body that isn't UTF-8
+            # mustn't raise here, in whichever task is running the connection's read loop.
+            body = b''.join(self.received_data)
+            self.received_data = []
+        self.value = nh2.rex.Response(self.request,
+                                      self.received_headers,
+                                      body,
+                                      trailers=self.received_trailers)
+
+    def reset(self, error_code):
+        """Mark the request as having been reset (by either the server or Connection.cancel)."""
+
+        self.error = StreamResetError(error_code)
+
+    def wake(self):
+        """Wake up any tasks waiting for something to happen to this stream."""
+
         if self.event:
             self.event.set()
 
+    def _result(self):
+        if self.error:
+            raise self.error
+        if isinstance(self.value.body, bytes):
+            self.value.body = self.value.body.decode('utf8')
+        return self.value
+
+    async def cancel(self):
+        """Reset the stream (if it hasn't already ended), telling the server to stop sending it."""
+
+        await self.connection.cancel(self)
+
     async def wait(self):
         """Wait until self.ended is called (running the connection loop if nobody else is)."""
 
+        await self._run_until(lambda: self.value or self.error)
+        return self._result()
+
+    async def wait_headers(self):
+        """Wait until the response's headers arrive, then return them."""
+
+        await self._run_until(lambda: self.received_headers is not None or self.error)
+        if self.error:
+            raise self.error
+        return self.received_headers
+
+    async def iter_data(self):
+        """Yield chunks of the response's body as they arrive (rather than after the stream ends).
+
+        Each chunk is only acknowledged to the server once the caller asks for the next one, so the
+        amount of data buffered for a slow caller is bounded by the stream's flow-control window.
+        (The connection's window is reopened right away, so other streams aren't held up.)
+        """
+
+        self.streaming = True
         while True:
+            await self._run_until(lambda: self.received_data or self.value or self.error)
+            chunks, self.received_data = self.received_data, []
+            if not chunks:
+                self._result()
+                return
+            for chunk in chunks:
+                yield chunk
+            if (length := self.unacknowledged):
+                self.unacknowledged = 0
+                await self.connection.acknowledge(self, length)
+
+    async def read_into(self, sink=None):
+        """Write the response's body straight into sink as it arrives, rather than collecting it.
+
+        sink may be a bytearray, a binary file (see nh2.sink.FileSink), or None for a new bytearray;
+        if the response has a content-length, the space is allocated up front. The returned
+        Response's body is the bytearray, the memory-mapped file, or the file object.
+
+        If the sink was already given to Connection.send, this just waits for the stream to end.
+        Otherwise, anything that arrived before read_into was called (possibly the whole body, if
+        another task was running the connection's read loop) was collected in memory first.
+        """
+
+        if self.sinking:
+            if sink is not None and sink is not self.sink_target:
+                raise ValueError('This stream already has a sink')
+        else:
+            self.sink_target = sink
+            self.sinking = True
             if self.value:
-                return self.value
+                # The stream already ended (and if someone else waited for it, decoded its body).
+                body = self.value.body
+                self.received_data = [body.encode('utf8') if isinstance(body, str) else body]
+                self._open_sink()
+                self.value.body = self.sink.close()
+        await self._run_until(lambda: self.value or self.error)
+        return self._result()
+
+    def _open_sink(self):
+        # This happens once the response's headers (and so its content-length) have arrived.
+        length = self.received_headers.get('content-length')
+        self.sink = nh2.sink.open_sink(self.sink_target, length and int(length))
+        for data in self.received_data:
+            self.sink.write(data)
+        self.received_data = []
+
+    async def _run_until(self, done):
+        """Wait until done() is true (running the connection loop if nobody else is)."""
 
+        while not done():
             if self.connection.running:
                 if not self.event:
                     self.event = anyio.Event()
-                await self.event.wait()
-                self.event = None
+                try:
+                    await self.event.wait()
+                finally:
+                    self.event = None
             else:
                 self.connection.running = True
-                while True:
-                    await self.connection.read()
-                    if self.value:
-                        self.connection.running = False
-                        for stream in self.connection.streams.values():
-                            if stream.event and not stream.event.is_set():
-                                stream.event.set()
-                                break
-                        return self.value
+                try:
+                    while not done():
+                        await self.connection.read()
+                finally:
+                    # Whether this stream finished or this task was cancelled, wake up everyone else
+                    # waiting on the connection so one of them can take over running it.
+                    self.connection.running = False
+                    self.connection.wake_waiters()
@@ -0,0 +1,73 @@
+"""gRPC-style length-prefixed message framing over a Stream.
+
+Each message is sent as a 1-byte compressed flag and a 4-byte big-endian length, followed by that
+many bytes of (possibly compressed) message.
+"""
+
+import struct
+
+_HEADER = struct.Struct('>BI')
+
+
+def encode(message, *, compress=None):
+    """Return message with its length prefix (compressing it first if compress is given)."""
+
+    if compress:
+        message = compress(message)
+    return _HEADER.pack(bool(compress), len(message)) + message
+
+
+class MessageDecoder:
+    """Incrementally split a byte stream into length-prefixed messages."""
+
+    def __init__(self, *, decompress=None, max_length=4 * 1024 * 1024):
+        self.decompress = decompress
+        self.max_length = max_length
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Return a list of the messages completed by data."""
+
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        pos = 0
+        while len(buffer) - pos >= _HEADER.size:
+            compressed, length = _HEADER.unpack_from(buffer, pos)
+            if length > self.max_length:
+                raise ValueError(f'Message of {length} bytes exceeds limit of {self.max_length}')
+            end = pos + _HEADER.size + length
+            if len(buffer) < end:
+                break
+            message = bytes(buffer[pos + _HEADER.size:end])
+            if compressed:
+                if not self.decompress:
+                    raise ValueError('Received a compressed message with no decompress function')
+                message = self.decompress(message)
+            messages.append(message)
+            pos = end
+        if pos:
+            del buffer[:pos]
+        return messages
+
+    def close(self):
+        """Verify the stream didn't end in the middle of a message."""
+
+        if self.buffer:
+            raise ValueError(f'Stream ended with {len(self.buffer)} bytes of incomplete message')
+
+
+async def send_message(stream, message, *, compress=None):
+    """Send message over stream (which must have been sent with end_stream=False)."""
+
+    await stream.write(encode(message, compress=compress))
+
+
+async def iter_messages(stream, *, decompress=None, max_length=4 * 1024 * 1024):
+    """Yield messages from stream's response body as they arrive."""
+
+    decoder = MessageDecoder(decompress=decompress, max_length=max_length)
+    async for chunk in stream.iter_data():
+        for message in decoder.feed(chunk):
+            yield message
+    decoder.close()
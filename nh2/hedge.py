@@ -0,0 +1,85 @@
+"""Hedged requests: race a duplicate of a slow idempotent request on another connection."""
+
+import collections
+import math
+
+import anyio
+
+import nh2.connection
+
+IDEMPOTENT_METHODS = frozenset(('DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE'))
+
+
+class Hedger:
+    """Send idempotent requests, duplicating any that haven't finished within a delay.
+
+    If delay is None, it is instead the given percentile of the latencies of the last history
+    requests sent through this Hedger (or initial_delay until there are any).
+    """
+
+    def __init__(self, *, delay=None, percentile=95, history=100, initial_delay=1):
+        self.delay = delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.latencies = collections.deque(maxlen=history)
+
+    def get_delay(self):
+        """Return how long to wait for a request before sending its duplicate."""
+
+        if self.delay is not None:
+            return self.delay
+        if not self.latencies:
+            return self.initial_delay
+        latencies = sorted(self.latencies)
+        # Nearest rank: the smallest latency at least percentile% of the latencies are <= to.
+        return latencies[max(0, math.ceil(len(latencies) * self.percentile / 100) - 1)]
+
+    async def send(self, connections, request):
+        """Send request over connections[0], and again over connections[1] if it's slow.
+
+        Whichever stream completes first provides the Response; the other is reset. (If there is
+        only one connection, the duplicate is sent over it too.)
+        """
+
+        if request.method not in IDEMPOTENT_METHODS:
+            raise ValueError(f'{request.method} requests are not idempotent and cannot be hedged')
+        if hasattr(request.body, 'read'):
+            # The duplicate would find the body already read (and send nothing after its headers).
+            raise ValueError('Streamed request bodies can only be sent once, so cannot be hedged')
+
+        started = anyio.current_time()
+        streams = []
+        failed = anyio.Event()
+        errors = []
+        response = None
+
+        async def attempt(connection):
+            nonlocal response
+            # Connection.send can be cancelled while it waits for its limiter (so a loser still
+            # queued there is never sent), but once it starts sending, it returns the stream.
+            streams.append(stream := await connection.send(request))
+            try:
+                value = await stream.wait()
+            except nh2.connection.StreamResetError as e:
+                errors.append(e)
+                failed.set()
+                return
+            if response is None:
+                response = value
+                tg.cancel_scope.cancel()
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(attempt, connections[0])
+            with anyio.move_on_after(self.get_delay()):
+                await failed.wait()
+            if response is None:
+                tg.start_soon(attempt, connections[1 % len(connections)])
+
+        for stream in streams:
+            if stream.value is not response:
+                await stream.cancel()
+
+        if response is None:
+            raise errors[0]
+        self.latencies.append(anyio.current_time() - started)
+        return response
@@ -0,0 +1,134 @@
+"""Client-side load shedding: an adaptive concurrency limit and per-authority rate limits."""
+
+import collections
+
+import anyio
+
+
+class Overloaded(Exception):
+    """A request was shed because too many others were already queued behind the limit."""
+
+
+class TokenBucket:
+    """A rate limit of rate requests per second, allowing bursts of up to burst requests."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def _refill(self):
+        now = anyio.current_time()
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Take a token, waiting until one is available if necessary."""
+
+        # Reserve the token up front (possibly going negative) so waiters are served in order.
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return
+        acquired = False
+        try:
+            await anyio.sleep(-self.tokens / self.rate)
+            acquired = True
+        finally:
+            if not acquired:
+                self.tokens += 1
+
+
+class Limiter:  # pylint: disable=too-many-instance-attributes
+    """An AIMD limit on the number of requests in flight, with optional per-authority rate limits.
+
+    Each request that completes in under latency_threshold seconds (if set) while the limit is at
+    least half in use grows the limit by 1/limit (so about one per limit's worth of completions).
+    Each request that is refused (REFUSED_STREAM, 429, or 503) or that exceeds latency_threshold
+    shrinks the limit by a factor of backoff, but only once per congestion event: requests that
+    were already in flight when the limit last shrank don't shrink it again. Requests beyond the
+    limit wait in a queue of up to max_queued entries; once that is full, acquire raises Overloaded
+    instead.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            *,
+            initial=20,
+            minimum=1,
+            maximum=1000,
+            backoff=.9,
+            latency_threshold=None,
+            max_queued=None,
+            rate=None,
+            burst=1):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = burst
+        self.inflight = 0
+        self.last_decrease = None
+        self.waiters = collections.deque()
+        self.buckets = {}
+
+    async def acquire(self, request):
+        """Wait until request may be sent (under both request.host's rate and the overall limit)."""
+
+        if self.rate:
+            if (bucket := self.buckets.get(request.host)) is None:
+                bucket = self.buckets[request.host] = TokenBucket(self.rate, self.burst)
+            await bucket.acquire()
+
+        if not self.waiters and self.inflight < self.limit:
+            self.inflight += 1
+            return
+
+        if self.max_queued is not None and len(self.waiters) >= self.max_queued:
+            raise Overloaded(f'{len(self.waiters)} requests already waiting for {request.host}')
+
+        # _wake counts the request as in flight before setting its event, so a newcomer can't steal
+        # the slot between the event being set and this task resuming.
+        event = anyio.Event()
+        self.waiters.append(event)
+        acquired = False
+        try:
+            await event.wait()
+            acquired = True
+        finally:
+            if not acquired:
+                if event.is_set():
+                    self.discard()
+                else:
+                    self.waiters.remove(event)
+
+    def release(self, latency, *, dropped=False):
+        """Record the outcome of a request let through by acquire, and admit any queued ones."""
+
+        if dropped or (self.latency_threshold is not None and latency > self.latency_threshold):
+            # A burst of refusals (like every stream over the server's max_concurrent_streams) is
+            # one signal, so only requests started since the last decrease can decrease it again.
+            now = anyio.current_time()
+            if self.last_decrease is None or now - latency > self.last_decrease:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.last_decrease = now
+        elif self.inflight * 2 >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.inflight -= 1
+        self._wake()
+
+    def discard(self):
+        """Give back a slot from acquire for a request that was never actually sent."""
+
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self.inflight < self.limit:
+            self.inflight += 1
+            self.waiters.popleft().set()
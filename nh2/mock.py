@@ -1,12 +1,20 @@
 """Utilities to control nh2 during tests."""
 
+import base64
+import collections
 import contextlib
+import json
+import math
+import os
 import textwrap
+import zlib
 
 import anyio
 import h2.config
 import h2.connection
 import h2.events
+import hpack
+import hyperframe.frame
 
 import nh2.anyio_util
 import nh2.connection
@@ -15,16 +23,30 @@ _servers = {}
 
 
 @contextlib.asynccontextmanager
-async def expect_connect(host, port, *, live=False):
-    """Prepare for an upcoming attempt to connect to host:port."""
+async def expect_connect(host, port, *, live=False, recording=None, settings=None):
+    """Prepare for an upcoming attempt to connect to host:port.
+
+    settings ({h2.settings.SettingCodes: value}) are added to the MockServer's initial SETTINGS.
+
+    If recording names an existing file, the connection is served from it by a ReplayServer.
+    Otherwise, if live is True, the connection goes to the real host:port (and, if recording is
+    given, the session is saved into it for later replay, both when this block exits, however it
+    exits, and when the connection is closed).
+    """
 
     assert (host, port) not in _servers
-    if live is True:
-        server = live
+    if recording is not None and os.path.exists(recording):
+        server = await ReplayServer(host, port, recording)
+    elif live is True:
+        server = live if recording is None else Recorder(recording)
     else:
-        server = await MockServer(host, port)
+        server = await MockServer(host, port, settings=settings)
     _servers[host, port] = server
-    yield server
+    try:
+        yield server
+    finally:
+        if isinstance(server, Recorder):
+            server.save()
     if (host, port) in _servers:
         await anyio.sleep(.01)
         assert (host, port) not in _servers
@@ -39,6 +61,8 @@ class MockConnection(nh2.connection.Connection):
         mock_server = _servers.pop((host, port))
         if mock_server is True:
             return await super()._connect(host, port)
+        if isinstance(mock_server, Recorder):
+            return mock_server.wrap(await super()._connect(host, port))
         self.mock_server = mock_server
         return self.mock_server.client_pipe_end
 
@@ -49,22 +73,29 @@ class MockConnection(nh2.connection.Connection):
         return events
 
 
-class MockServer:
+class MockServer:  # pylint: disable=too-many-instance-attributes
     """An HTTP/2 server connection."""
 
-    async def __new__(cls, host, port):  # pylint: disable=invalid-overridden-method
+    async def __new__(cls, host, port, *, settings=None):  # pylint: disable=invalid-overridden-method
         self = super().__new__(cls)
-        await self.__init__(host, port)
+        await self.__init__(host, port, settings=settings)
         return self
 
-    async def __init__(self, host, port):
+    async def __init__(self, host, port, *, settings=None):
         self.host = host
         self.port = port
-        self.client_pipe_end, self.s = nh2.anyio_util.create_pipe()
+        client_pipe_end, s = nh2.anyio_util.create_pipe()
+        self.client_stats = WireStats(client=True)
+        self.server_stats = WireStats()
+        self.client_pipe_end = _CountingStream(client_pipe_end, self.client_stats)
+        self.s = _CountingStream(s, self.server_stats)
         self.client_events = []
 
         self.c = h2.connection.H2Connection(
             config=h2.config.H2Configuration(client_side=False, header_encoding='utf8'))
+        if settings:
+            self.c.local_settings.update(settings)
+            self.c.local_settings.acknowledge()
         self.c.initiate_connection()
         await self.flush()
 
@@ -91,6 +122,16 @@ class MockServer:
         self.client_events = []
         return _DedentingString(_format(events))
 
+    def get_client_stats(self):
+        """Return a string summarizing what the client has written since the last call."""
+
+        return self.client_stats.pop()
+
+    def get_server_stats(self):
+        """Return a string summarizing what the server has written since the last call."""
+
+        return self.server_stats.pop()
+
     async def flush(self):
         """Send any pending data to the client."""
 
@@ -98,6 +139,331 @@ class MockServer:
             await self.s.send(data)
 
 
+class Recorder:
+    """A socket-like wrapper that saves the bytes exchanged over a live connection to path."""
+
+    stream = None
+
+    def __init__(self, path):
+        self.path = path
+        self.sent = []
+        self.received = []
+
+    def wrap(self, stream):
+        """Start recording traffic over stream."""
+
+        self.stream = stream
+        return self
+
+    async def send(self, data):
+        """Record data, then send it."""
+
+        self.sent.append(data)
+        await self.stream.send(data)
+
+    async def receive(self, max_bytes=65536):
+        """Receive (and record) up to max_bytes."""
+
+        data = await self.stream.receive(max_bytes)
+        self.received.append(data)
+        return data
+
+    async def aclose(self):
+        """Close the underlying stream, and save the recording."""
+
+        await self.stream.aclose()
+        self.save()
+
+    def save(self):
+        """Save everything recorded so far (if the connection was ever made)."""
+
+        if self.stream is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w', encoding='utf8') as fobj:
+            json.dump({'sent': _pack(self.sent), 'received': _pack(self.received)}, fobj)
+
+
+def _pack(chunks):
+    return base64.b64encode(zlib.compress(b''.join(chunks), 9)).decode('ascii')
+
+
+def _unpack(text):
+    return zlib.decompress(base64.b64decode(text))
+
+
+class ReplayServer(MockServer):
+    """A MockServer that automatically answers requests with responses from a Recorder's file.
+
+    Requests are matched by method, path, and body, so they can be sent in any order and with any
+    stream IDs (identical requests get their recorded responses in order). Header blocks are decoded
+    when the recording is loaded and re-encoded as they're replayed, so the replay's HPACK state is
+    independent of the recorded session's.
+    """
+
+    async def __new__(cls, host, port, recording):  # pylint: disable=invalid-overridden-method
+        self = object.__new__(cls)
+        await self.__init__(host, port, recording)
+        return self
+
+    async def __init__(self, host, port, recording):  # pylint: disable=invalid-overridden-method
+        self.responses = _load_recording(recording)
+        self.requests = {}
+        self.pending = {}
+        await super().__init__(host, port)
+        self.client_pipe_end = _RespondingStream(self.client_pipe_end, self)
+
+    async def respond(self):
+        """Handle whatever the client just sent, answering any requests it completed."""
+
+        data = await self.s.receive(65536 * 1024)
+        for event in self.c.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.requests[event.stream_id] = (dict(event.headers), [])
+            elif isinstance(event, h2.events.DataReceived):
+                self.requests[event.stream_id][1].append(event.data)
+                self.c.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                headers, body = self.requests.pop(event.stream_id)
+                self._start_response(event.stream_id, headers, b''.join(body))
+            elif isinstance(event, h2.events.StreamReset):
+                self.requests.pop(event.stream_id, None)
+                self.pending.pop(event.stream_id, None)
+        self._send_pending()
+        await self.flush()
+
+    def _start_response(self, stream_id, headers, body):
+        method, path = headers[':method'], headers[':path']
+        if not (queue := self.responses.get((method, path, body))):
+            raise AssertionError(f'No recorded response to {method} {path}')
+        if (response := queue.popleft()) is None:
+            return
+        response_headers, data, trailers = response
+        self.c.send_headers(stream_id, response_headers, end_stream=not data and not trailers)
+        if data or trailers:
+            self.pending[stream_id] = (data, trailers)
+
+    def _send_pending(self):
+        for stream_id, (data, trailers) in list(self.pending.items()):
+            while data and (window := self.c.local_flow_control_window(stream_id)):
+                chunk = data[:min(window, self.c.max_outbound_frame_size)]
+                data = data[len(chunk):]
+                self.c.send_data(stream_id, chunk, end_stream=not data and not trailers)
+            if data:
+                self.pending[stream_id] = (data, trailers)
+                continue
+            del self.pending[stream_id]
+            if trailers:
+                self.c.send_headers(stream_id, trailers, end_stream=True)
+
+
+class _RespondingStream:
+    """The client's end of a ReplayServer's pipe, which has the server respond to each write."""
+
+    def __init__(self, stream, server):
+        self.stream = stream
+        self.server = server
+
+    async def send(self, data):
+        """Send data, then let the server respond to it."""
+
+        await self.stream.send(data)
+        await self.server.respond()
+
+    async def receive(self, max_bytes=65536):
+        """Receive up to max_bytes."""
+
+        return await self.stream.receive(max_bytes)
+
+    async def aclose(self):
+        """Close the underlying stream."""
+
+        await self.stream.aclose()
+
+
+def _load_recording(path):
+    with open(path, encoding='utf8') as fobj:
+        recording = json.load(fobj)
+    requests = _parse_frames(_unpack(recording['sent'])[len(_PREFACE):])
+    responses = _parse_frames(_unpack(recording['received']))
+    exchanges = collections.defaultdict(collections.deque)
+    for stream_id, (headers, body, unused_trailers) in requests.items():
+        headers = dict(headers)
+        # None marks a request the recorded session closed before getting a response to.
+        exchanges[headers[':method'], headers[':path'], body].append(responses.get(stream_id))
+    return exchanges
+
+
+def _parse_frames(data):
+    """Return {stream_id: (headers, body, trailers)} for each stream ended within data."""
+
+    decoder = hpack.Decoder()
+    streams = collections.defaultdict(lambda: [None, [], None])
+    ended = set()
+    block = []
+    view = memoryview(data)
+    pos = 0
+    while pos + 9 <= len(view):
+        frame, length = hyperframe.frame.Frame.parse_frame_header(view[pos:pos + 9])
+        frame.parse_body(view[pos + 9:pos + 9 + length])
+        pos += 9 + length
+
+        if isinstance(frame, (hyperframe.frame.HeadersFrame, hyperframe.frame.PushPromiseFrame)):
+            first = frame
+            block = [frame.data]
+        elif isinstance(frame, hyperframe.frame.ContinuationFrame):
+            block.append(frame.data)
+        elif isinstance(frame, hyperframe.frame.DataFrame):
+            streams[frame.stream_id][1].append(frame.data)
+            if 'END_STREAM' in frame.flags:
+                ended.add(frame.stream_id)
+            continue
+        else:
+            continue
+
+        if 'END_HEADERS' not in frame.flags:
+            continue
+        # Every header block is decoded (even pushed requests'), to keep the HPACK state in sync.
+        headers = decoder.decode(b''.join(block))
+        if isinstance(first, hyperframe.frame.PushPromiseFrame):
+            continue
+        stream = streams[first.stream_id]
+        if stream[0] is None or dict(stream[0])[':status'].startswith('1'):
+            stream[0] = headers
+        else:
+            stream[2] = headers
+        if 'END_STREAM' in first.flags:
+            ended.add(first.stream_id)
+
+    return {
+        stream_id: (headers, b''.join(body), trailers)
+        for stream_id, (headers, body, trailers) in streams.items()
+        if stream_id in ended
+    }
+
+
+_FRAME_TYPES = {
+    0x0: 'DATA',
+    0x1: 'HEADERS',
+    0x2: 'PRIORITY',
+    0x3: 'RST_STREAM',
+    0x4: 'SETTINGS',
+    0x5: 'PUSH_PROMISE',
+    0x6: 'PING',
+    0x7: 'GOAWAY',
+    0x8: 'WINDOW_UPDATE',
+    0x9: 'CONTINUATION',
+}
+_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+_TLS_RECORD_SIZE = 16384
+
+
+class WireStats:
+    """Counts of the writes, bytes, TLS records, and HTTP/2 frames sent by one side of a pipe.
+
+    Frames are counted by type both for the whole connection (frames) and per stream
+    (stream_frames[stream_id]); records is how many TLS records the writes would have needed.
+    """
+
+    def __init__(self, *, client=False):
+        self.preface = client
+        self.pending = b''
+        self.writes = self.bytes = self.records = 0
+        self.frames = collections.Counter()
+        self.stream_frames = collections.defaultdict(collections.Counter)
+
+    def record(self, data):
+        """Account for one write of data."""
+
+        self.writes += 1
+        self.bytes += len(data)
+        self.records += math.ceil(len(data) / _TLS_RECORD_SIZE)
+
+        data = self.pending + data
+        pos = 0
+        if self.preface:
+            if len(data) < len(_PREFACE):
+                self.pending = data
+                return
+            self.preface = False
+            pos = len(_PREFACE)
+        while len(data) - pos >= 9:
+            length = int.from_bytes(data[pos:pos + 3], 'big')
+            if len(data) - pos < 9 + length:
+                break
+            frame_type = _FRAME_TYPES.get(data[pos + 3], f'UNKNOWN_{data[pos + 3]}')
+            stream_id = int.from_bytes(data[pos + 5:pos + 9], 'big') & 0x7fffffff
+            self.frames[frame_type] += 1
+            if stream_id:
+                self.stream_frames[stream_id][frame_type] += 1
+            pos += 9 + length
+        self.pending = data[pos:]
+
+    def assert_at_most(self, *, stream_id=None, **limits):
+        """Fail if any count exceeds its limit (given as writes=, bytes=, records=, DATA=, etc.).
+
+        With stream_id, the limits apply to that stream's frames (stream_frames[stream_id]) instead,
+        so only frame types may be given.
+        """
+
+        if stream_id is None:
+            counts = {'writes': self.writes, 'bytes': self.bytes, 'records': self.records}
+            frames = self.frames
+        else:
+            counts = {}
+            frames = self.stream_frames.get(stream_id, collections.Counter())
+            if (unknown := {'writes', 'bytes', 'records'}.intersection(limits)):
+                raise TypeError(f'{", ".join(sorted(unknown))} not counted per stream')
+        over = []
+        for name, limit in limits.items():
+            count = counts[name] if name in counts else frames[name]
+            if count > limit:
+                over.append(f'{name}={count} (limit {limit})')
+        where = '' if stream_id is None else f' on stream {stream_id}'
+        assert not over, f'Too many{where}: {", ".join(over)}'
+
+    def pop(self):
+        """Return a string summarizing the counts, and reset them."""
+
+        lines = [f'writes={self.writes} bytes={self.bytes} records={self.records}']
+        if self.frames:
+            lines.append(_format_counter(self.frames))
+        for stream_id, frames in sorted(self.stream_frames.items()):
+            lines.append(f'stream {stream_id}: {_format_counter(frames)}')
+        self.writes = self.bytes = self.records = 0
+        self.frames = collections.Counter()
+        self.stream_frames = collections.defaultdict(collections.Counter)
+        return _DedentingString('\n'.join(lines))
+
+
+def _format_counter(counter):
+    return ' '.join(f'{k}={v}' for k, v in sorted(counter.items()))
+
+
+class _CountingStream:
+    """A socket-like object that records everything sent through it in a WireStats."""
+
+    def __init__(self, stream, stats):
+        self.stream = stream
+        self.stats = stats
+
+    async def send(self, data):
+        """Record data, then send it."""
+
+        self.stats.record(data)
+        await self.stream.send(data)
+
+    async def receive(self, max_bytes=65536):
+        """Receive up to max_bytes."""
+
+        return await self.stream.receive(max_bytes)
+
+    async def aclose(self):
+        """Close the underlying stream."""
+
+        await self.stream.aclose()
+
+
 def _format(obj):
     return ''.join(_do_format(obj, 0)).strip()
 
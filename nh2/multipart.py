@@ -0,0 +1,124 @@
+"""Lazily generated multipart/form-data request bodies."""
+
+import collections
+import io
+import os
+import secrets
+
+import nh2.rex
+
+
+def _quote(value):
+    return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+class _File:
+    """A file part's contents, opened (if given as a path) only once they're actually read."""
+
+    def __init__(self, file):
+        self.path = None
+        self.file = None
+        if isinstance(file, (str, os.PathLike)):
+            self.path = file
+        else:
+            self.file = file
+
+    def length(self):
+        """Return the number of bytes left to read, or None if that can't be determined."""
+
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        try:
+            if not self.file.seekable():
+                return None
+            position = self.file.tell()
+            end = self.file.seek(0, io.SEEK_END)
+            self.file.seek(position)
+        except (AttributeError, OSError):
+            return None
+        return end - position
+
+    def read(self, size):
+        """Return up to size bytes (or b'' at the end, closing the file if we opened it)."""
+
+        if self.file is None:
+            self.file = open(self.path, 'rb')  # pylint: disable=consider-using-with
+        data = self.file.read(size)
+        if not data and self.path is not None:
+            self.file.close()
+        return data
+
+
+class Multipart:
+    """A multipart/form-data body whose parts are only read as the request is sent.
+
+    Pass it as a Request's body; the request's content-type (and, if every part's size is known,
+    content-length) are filled in from it, and Stream.send_body reads it one frame at a time.
+    """
+
+    def __init__(self, boundary=None):
+        self.boundary = boundary or secrets.token_hex(16)
+        self.contenttype = nh2.rex.ContentType(f'multipart/form-data; boundary={self.boundary}')
+        self.closing = f'--{self.boundary}--\r\n'.encode('utf8')
+        self.segments = collections.deque()
+        self.length = len(self.closing)
+        self.started = False
+
+    def _add(self, name, source, *, filename=None, contenttype=None):
+        assert not self.started
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        header = f'--{self.boundary}\r\ncontent-disposition: {disposition}\r\n'
+        if contenttype:
+            header += f'content-type: {contenttype}\r\n'
+        header = f'{header}\r\n'.encode('utf8')
+
+        self.segments.extend((header, source, b'\r\n'))
+        if self.length is not None:
+            if isinstance(source, _File):
+                length = source.length()
+            else:
+                length = len(source)
+            if length is None:
+                self.length = None
+            else:
+                self.length += len(header) + length + 2
+
+    def add_field(self, name, value, *, contenttype=None):
+        """Add a part whose value is a str (sent as UTF-8) or bytes."""
+
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        self._add(name, value, contenttype=contenttype)
+
+    def add_file(self, name, file, *, filename=None, contenttype='application/octet-stream'):
+        """Add a part read from file (either a path or a binary file object)."""
+
+        if filename is None and isinstance(file, (str, os.PathLike)):
+            filename = os.path.basename(file)
+        self._add(name, _File(file), filename=filename, contenttype=contenttype)
+
+    def read(self, size):
+        """Return up to the next size bytes of the body (or b'' once it's all been read)."""
+
+        if not self.started:
+            self.started = True
+            self.segments.append(self.closing)
+
+        pieces = []
+        while size and self.segments:
+            segment = self.segments[0]
+            if isinstance(segment, _File):
+                if not (data := segment.read(size)):
+                    self.segments.popleft()
+                    continue
+            else:
+                data = segment[:size]
+                if len(data) < len(segment):
+                    self.segments[0] = segment[size:]
+                else:
+                    self.segments.popleft()
+            pieces.append(data)
+            size -= len(data)
+        return b''.join(pieces)
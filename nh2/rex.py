@@ -27,7 +27,7 @@ class ContentType:
 class Request:
     """An HTTP/2 request."""
 
-    def __init__(self, method, host, path, *, headers=(), body=None, json=None):  # pylint: disable=too-many-arguments
+    def __init__(self, method, host, path, *, headers=(), body=None, json=None, trailers=()):  # pylint: disable=too-many-arguments
         self.method = method
         self.host = host
         self.path = path
@@ -50,20 +50,28 @@ class Request:
                 self.contenttype.mediatype = 'text/plain'
             self.contenttype.charset = 'utf-8'
             body = body.encode('utf-8')
+        if hasattr(body, 'read'):
+            # File-like bodies (like nh2.multipart.Multipart) are read incrementally while sending.
+            if self.contenttype.mediatype is None and hasattr(body, 'contenttype'):
+                self.contenttype = body.contenttype
+            if (length := getattr(body, 'length', None)) is not None:
+                self.headers['content-length'] = str(length)
         if self.contenttype.mediatype:
             self.headers['content-type'] = str(self.contenttype)
         self.body = body or b''
+        self.trailers = dict(trailers)
 
 
 class Response:
     """An HTTP/2 response."""
 
-    def __init__(self, request, headers, body):
+    def __init__(self, request, headers, body, *, trailers=None):
         self.request = request
         self.headers = headers
         self.status = int(headers[':status'])
         self.contenttype = ContentType(headers.get('content-type', ''))
         self.body = body
+        self.trailers = trailers or {}
 
     def json(self):
         """Parse (and return) self.body as a JSON object."""
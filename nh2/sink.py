@@ -0,0 +1,88 @@
+"""Destinations that response bodies can be written into directly as they arrive."""
+
+import io
+import mmap
+
+
+class BufferSink:
+    """Write a body into a bytearray, preallocated to the body's length when that's known."""
+
+    def __init__(self, buffer, length):
+        if buffer is None:
+            buffer = bytearray(length or 0)
+        elif length and len(buffer) < length:
+            buffer.extend(bytes(length - len(buffer)))
+        self.buffer = buffer
+        self.pos = 0
+
+    def write(self, data):
+        """Copy data into the buffer (overwriting preallocated space, then growing it)."""
+
+        end = self.pos + len(data)
+        self.buffer[self.pos:end] = data
+        self.pos = end
+
+    def close(self):
+        """Trim the buffer to the body's actual length, and return it."""
+
+        del self.buffer[self.pos:]
+        return self.buffer
+
+
+class FileSink:
+    """Write a body into a binary file.
+
+    When the body's length is known and the file is empty and opened for both reading and writing
+    (like 'w+b'), the file is extended to fit and memory-mapped, and the body is copied straight
+    into the mapping. Otherwise each chunk is written to the file as it arrives.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.mmap = None
+        self.pos = 0
+        if length:
+            try:
+                file.flush()
+                if not file.tell() and not file.seek(0, io.SEEK_END):
+                    file.truncate(length)
+                    self.mmap = mmap.mmap(file.fileno(), length)
+            except (AttributeError, OSError, ValueError):
+                self.mmap = None
+
+    def write(self, data):
+        """Copy data into the mapping (or append it to the file)."""
+
+        if self.mmap is None:
+            self.file.write(data)
+        else:
+            end = self.pos + len(data)
+            self.mmap[self.pos:end] = data
+            self.pos = end
+
+    def close(self):
+        """Return the mapping (with the file positioned after the body), or the file itself.
+
+        If the body turned out shorter than its length (like a HEAD response's), the file is trimmed
+        to what was actually written, and remapped (or, if that was nothing, returned itself).
+        """
+
+        if self.mmap is None:
+            return self.file
+        self.mmap.flush()
+        if self.pos < len(self.mmap):
+            self.mmap.close()
+            self.file.truncate(self.pos)
+            self.mmap = None
+            if self.pos:
+                self.mmap = mmap.mmap(self.file.fileno(), self.pos)
+        self.file.seek(self.pos)
+        return self.file if self.mmap is None else self.mmap
+
+
+def open_sink(target, length):
+    """Return a sink writing into target (a bytearray, binary file, or None for a new bytearray)."""
+
+    if target is None or isinstance(target, bytearray):
+        return BufferSink(target, length)
+    return FileSink(target, length)
@@ -0,0 +1,157 @@
+"""Incremental decoders for streaming response formats (Server-Sent Events and NDJSON)."""
+
+import json as _json
+import re
+
+_NEWLINE = re.compile(rb'\r\n|\r|\n')
+
+
+class _LineSplitter:
+    """Split a byte stream into lines, scanning each chunk only once however lines straddle them."""
+
+    def __init__(self, newline=_NEWLINE):
+        self.newline = newline
+        self.pending = []
+        self.skip_lf = False
+
+    def feed(self, data):
+        """Return a list of the lines completed by data (without their line terminators)."""
+
+        start = 0
+        if self.skip_lf:
+            # The previous chunk ended with a '\r' that may have been the first half of a '\r\n'.
+            self.skip_lf = False
+            if data[:1] == b'\n':
+                start = 1
+        lines = []
+        for match in self.newline.finditer(data, start):
+            if self.pending:
+                self.pending.append(data[start:match.start()])
+                lines.append(b''.join(self.pending))
+                self.pending = []
+            else:
+                lines.append(data[start:match.start()])
+            start = match.end()
+        if start < len(data):
+            self.pending.append(data[start:])
+        elif data[-1:] == b'\r':
+            self.skip_lf = True
+        return lines
+
+    def close(self):
+        """Return whatever partial line was left after the last chunk."""
+
+        line = b''.join(self.pending)
+        self.pending = []
+        return line
+
+
+class ServerSentEvent:
+    """A single event from a text/event-stream."""
+
+    def __init__(self, data, *, event='message', id=None, retry=None):  # pylint: disable=redefined-builtin
+        self.data = data
+        self.event = event
+        self.id = id  # pylint: disable=invalid-name
+        self.retry = retry
+
+
+class SSEDecoder:
+    """Incrementally parse a text/event-stream body into ServerSentEvents."""
+
+    def __init__(self):
+        self.lines = _LineSplitter()
+        self.started = False
+        self.data = []
+        self.event = None
+        self.last_id = None
+        self.retry = None
+
+    def feed(self, data):
+        """Return a list of the ServerSentEvents completed by data."""
+
+        if not self.started and data:
+            self.started = True
+            if data.startswith(b'\xef\xbb\xbf'):
+                data = data[3:]
+        events = []
+        for line in self.lines.feed(data):
+            if (event := self._process_line(line.decode('utf8', 'replace'))):
+                events.append(event)
+        return events
+
+    def close(self):
+        """Discard any incomplete event (as the spec requires when the stream ends)."""
+
+        self.lines.close()
+        self.data = []
+        self.event = None
+
+    def _process_line(self, line):
+        if not line:
+            if not self.data:
+                self.event = None
+                return None
+            event = ServerSentEvent('\n'.join(self.data),
+                                    event=self.event or 'message',
+                                    id=self.last_id,
+                                    retry=self.retry)
+            self.data = []
+            self.event = None
+            return event
+
+        if line.startswith(':'):
+            return None
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'data':
+            self.data.append(value)
+        elif field == 'event':
+            self.event = value
+        elif field == 'id':
+            if '\0' not in value:
+                self.last_id = value
+        elif field == 'retry':
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+
+class NDJSONDecoder:
+    """Incrementally parse a newline-delimited JSON body into objects."""
+
+    def __init__(self):
+        self.lines = _LineSplitter(re.compile(rb'\n'))
+
+    def feed(self, data):
+        """Return a list of the objects completed by data."""
+
+        return [_json.loads(line) for line in self.lines.feed(data) if line.strip()]
+
+    def close(self):
+        """Return a list containing the final object, if the body didn't end with a newline."""
+
+        line = self.lines.close()
+        return [_json.loads(line)] if line.strip() else []
+
+
+async def iter_events(stream):
+    """Yield ServerSentEvents from stream's response body as they arrive."""
+
+    decoder = SSEDecoder()
+    async for chunk in stream.iter_data():
+        for event in decoder.feed(chunk):
+            yield event
+    decoder.close()
+
+
+async def iter_ndjson(stream):
+    """Yield objects from stream's newline-delimited JSON response body as they arrive."""
+
+    decoder = NDJSONDecoder()
+    async for chunk in stream.iter_data():
+        for obj in decoder.feed(chunk):
+            yield obj
+    for obj in decoder.close():
+        yield obj
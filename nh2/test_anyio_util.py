@@ -67,3 +67,133 @@ async def test_create_task_group_exceptions_break_await():
     assert started.is_set()
     assert len(excinfo.value.exceptions) == 1
     assert isinstance(excinfo.value.exceptions[0], MyError)
+
+
+async def test_as_completed():
+    """Verify as_completed yields results as they finish, never running more than limit at once."""
+
+    running = peak = 0
+
+    async def sleep_for(delay):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await anyio.sleep(delay / 100)
+        running -= 1
+        return delay * 10
+
+    async with nh2.anyio_util.as_completed(sleep_for, [5, 1, 2], limit=2) as results:
+        assert [pair async for pair in results] == [(1, 10), (2, 20), (5, 50)]
+    assert peak == 2
+
+
+async def test_as_completed_lazy():
+    """Verify items are only pulled as workers free up, and leaving early cancels the rest."""
+
+    pulled = []
+    finished = []
+
+    def generate():
+        for i in range(1000):
+            pulled.append(i)
+            yield i
+
+    async def work(i):
+        await anyio.sleep(.001)
+        finished.append(i)
+        return i
+
+    async with nh2.anyio_util.as_completed(work, generate(), limit=3) as results:
+        async for item, unused_result in results:
+            if item == 1:
+                break
+    assert len(pulled) < 10
+    await anyio.sleep(.01)
+    assert len(finished) < 10
+
+
+async def test_as_completed_exception():
+    """Verify an exception from one call cancels the others and propagates."""
+
+    class MyError(Exception):  # pylint: disable=missing-class-docstring
+        pass
+
+    cancelled = []
+
+    async def work(i):
+        if i == 0:
+            raise MyError
+        try:
+            await anyio.sleep(1)
+        finally:
+            cancelled.append(i)
+
+    with pytest.raises(Exception) as excinfo:
+        async with nh2.anyio_util.as_completed(work, range(3), limit=3) as results:
+            async for unused_pair in results:
+                pass
+    assert excinfo.group_contains(MyError)
+    assert sorted(cancelled) == [1, 2]
+
+
+async def test_map_concurrent():
+    """Verify map_concurrent yields results in input order."""
+
+    async def work(i):
+        await anyio.sleep((5 - i) / 1000)
+        return i * i
+
+    async with nh2.anyio_util.map_concurrent(work, range(5), limit=2) as results:
+        assert [result async for result in results] == [0, 1, 4, 9, 16]
+    async with nh2.anyio_util.map_concurrent(work, [], limit=2) as results:
+        assert [result async for result in results] == []
+
+
+async def test_map_concurrent_bounded():
+    """Verify a slow item holds back later ones instead of letting their results pile up."""
+
+    pulled = []
+    finished = []
+    release = anyio.Event()
+
+    def generate():
+        for i in range(1000):
+            pulled.append(i)
+            yield i
+
+    async def work(i):
+        if i == 0:
+            await release.wait()
+        finished.append(i)
+        return i
+
+    async with nh2.anyio_util.map_concurrent(work, generate(), limit=3) as results:
+        await anyio.sleep(.01)
+        # Item 0 is stuck, so only 1 and 2 could be started (and finish) behind it.
+        assert pulled == [0, 1, 2]
+        assert finished == [1, 2]
+        release.set()
+        count = 0
+        async for result in results:
+            assert result == count
+            count += 1
+            assert len(pulled) <= count + 3
+    assert count == 1000
+
+
+async def test_map_concurrent_exception():
+    """Verify an exception from one call cancels the others and propagates, wrapped in groups."""
+
+    class MyError(Exception):  # pylint: disable=missing-class-docstring
+        pass
+
+    async def work(i):
+        if i == 1:
+            raise MyError
+        await anyio.sleep(1)
+
+    with pytest.raises(Exception) as excinfo:
+        async with nh2.anyio_util.map_concurrent(work, range(3), limit=3) as results:
+            async for unused_result in results:
+                pass
+    assert excinfo.group_contains(MyError, depth=None)
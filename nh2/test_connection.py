@@ -1,6 +1,11 @@
 """Tests for nh2.connection."""
 
+import os
+import subprocess
+import sys
+
 import anyio
+import h2.settings
 import pytest
 
 import nh2.connection
@@ -9,86 +14,133 @@ import nh2.rex
 
 pytestmark = pytest.mark.anyio
 
+_RECORD = bool(os.environ.get('NH2_RECORD'))
+
+
+def _recording(name):
+    # Live tests replay these recordings of their sessions with httpbin.org. To record one again,
+    # delete it and run the test with NH2_RECORD=1 (which lets it connect to the real server).
+    path = os.path.join(os.path.dirname(__file__), 'recordings', f'{name}.json')
+    if not os.path.exists(path) and not _RECORD:
+        pytest.fail(f'{path} is missing (run with NH2_RECORD=1 to record it)')
+    return path
+
+
+def test_lazy_initialization():
+    """Verify importing nh2.connection doesn't import h2 or build an SSL context until needed."""
+
+    code = ('import sys, nh2.connection\n'
+            'print("h2" in sys.modules, nh2.connection._ssl_context.cache_info().currsize)\n'
+            'nh2.connection._ssl_context()\n'
+            'nh2.connection.h2.events\n'
+            'print("h2" in sys.modules, nh2.connection._ssl_context.cache_info().currsize)\n')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(nh2.connection.__file__)))
+    output = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True,
+                            check=True,
+                            cwd=root,
+                            text=True).stdout
+    assert output.split() == ['False', '0', 'True', '1']
+
+
+def test_ctx():
+    """Verify nh2.connection.ctx is still the (customizable) SSL context every connection uses."""
+
+    ctx = nh2.connection.ctx
+    assert ctx is nh2.connection._ssl_context()  # pylint: disable=protected-access
+    assert ctx is nh2.connection.ctx
+    with pytest.raises(AttributeError):
+        nh2.connection.no_such_attribute  # pylint: disable=pointless-statement
+
 
 async def test_simple():
     """Basic functionality."""
 
-    async with nh2.mock.expect_connect('httpbin.org', 443, live=True):
+    async with nh2.mock.expect_connect('httpbin.org',
+                                       443,
+                                       live=_RECORD,
+                                       recording=_recording('test_simple')):
         conn = await nh2.connection.Connection('httpbin.org', 443)
-    try:
-        assert not conn.streams
-        stream = await conn.request('GET', '/get?a=b')
-        assert len(conn.streams) == 1
-        response = await stream.wait()
-        assert not conn.streams
-        assert response.status == 200
-        assert response.headers['content-type'] == 'application/json'
-        data = response.json()
-        assert data['args'] == {'a': 'b'}
-
-        stream = await conn.request('POST', '/post', json={'c': 'd'})
-        assert len(conn.streams) == 1
-        response = await stream.wait()
-        assert not conn.streams
-        assert response.status == 200
-        assert response.headers['content-type'] == 'application/json'
-        data = response.json()
-        assert data['json'] == {'c': 'd'}
-    finally:
-        await conn.close()
+        try:
+            assert not conn.streams
+            stream = await conn.request('GET', '/get?a=b')
+            assert len(conn.streams) == 1
+            response = await stream.wait()
+            assert not conn.streams
+            assert response.status == 200
+            assert response.headers['content-type'] == 'application/json'
+            data = response.json()
+            assert data['args'] == {'a': 'b'}
+
+            stream = await conn.request('POST', '/post', json={'c': 'd'})
+            assert len(conn.streams) == 1
+            response = await stream.wait()
+            assert not conn.streams
+            assert response.status == 200
+            assert response.headers['content-type'] == 'application/json'
+            data = response.json()
+            assert data['json'] == {'c': 'd'}
+        finally:
+            await conn.close()
 
 
 async def test_concurrent_send():
     """Verify the Connection can handle multiple concurrent sends."""
 
-    async with nh2.mock.expect_connect('httpbin.org', 443, live=True):
+    async with nh2.mock.expect_connect('httpbin.org',
+                                       443,
+                                       live=_RECORD,
+                                       recording=_recording('test_concurrent_send')):
         conn = await nh2.connection.Connection('httpbin.org', 443)
-    try:
-        async with anyio.create_task_group() as tg:
-            tg.start_soon(conn.request, 'GET', '/get?a=1')
-            tg.start_soon(conn.request, 'GET', '/get?a=2')
-    finally:
-        await conn.close()
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(conn.request, 'GET', '/get?a=1')
+                tg.start_soon(conn.request, 'GET', '/get?a=2')
+        finally:
+            await conn.close()
 
 
 async def test_concurrent_wait():
     """Verify the interaction between two concurrent Stream.wait()s."""
 
-    async with nh2.mock.expect_connect('httpbin.org', 443, live=True):
+    async with nh2.mock.expect_connect('httpbin.org',
+                                       443,
+                                       live=_RECORD,
+                                       recording=_recording('test_concurrent_wait')):
         conn = await nh2.connection.Connection('httpbin.org', 443)
-    try:
-        res1 = res2 = None
+        try:
+            res1 = res2 = None
 
-        async with anyio.create_task_group() as tg:
-            assert not conn.streams
-            req1 = await conn.request('GET', '/get?a=b')
-            assert len(conn.streams) == 1
-            req2 = await conn.request('POST', '/post', json={'c': 'd'})
-            assert len(conn.streams) == 2
+            async with anyio.create_task_group() as tg:
+                assert not conn.streams
+                req1 = await conn.request('GET', '/get?a=b')
+                assert len(conn.streams) == 1
+                req2 = await conn.request('POST', '/post', json={'c': 'd'})
+                assert len(conn.streams) == 2
 
-            async def run_req1():
-                nonlocal res1
-                res1 = await req1.wait()
+                async def run_req1():
+                    nonlocal res1
+                    res1 = await req1.wait()
 
-            tg.start_soon(run_req1)
+                tg.start_soon(run_req1)
 
-            async def run_req2():
-                nonlocal res2
-                res2 = await req2.wait()
+                async def run_req2():
+                    nonlocal res2
+                    res2 = await req2.wait()
 
-            tg.start_soon(run_req2)
+                tg.start_soon(run_req2)
 
-        assert res1.status == 200
-        assert res1.headers['content-type'] == 'application/json'
-        data = res1.json()
-        assert data['args'] == {'a': 'b'}
+            assert res1.status == 200
+            assert res1.headers['content-type'] == 'application/json'
+            data = res1.json()
+            assert data['args'] == {'a': 'b'}
 
-        assert res2.status == 200
-        assert res2.headers['content-type'] == 'application/json'
-        data = res2.json()
-        assert data['json'] == {'c': 'd'}
-    finally:
-        await conn.close()
+            assert res2.status == 200
+            assert res2.headers['content-type'] == 'application/json'
+            data = res2.json()
+            assert data['json'] == {'c': 'd'}
+        finally:
+            await conn.close()
 
 
 async def test_stream_send():
@@ -138,3 +190,93 @@ async def test_stream_send():
     assert conn.c.window == 90
     assert conn.c.sent == [b'55555', b'7777777', b'333']
     assert stream.tosend == b''
+
+
+async def test_read_batch():
+    """Verify a batch of events is acknowledged and flushed once, however many frames it holds."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream1 = await conn.request('GET', '/a')
+    stream3 = await conn.request('GET', '/b')
+    await mock_server.read()
+    await mock_server.read()
+    await mock_server.read()
+    await conn.read()  # The server's settings.
+    await conn.read()  # The server's acknowledgment of the client's settings.
+    mock_server.get_client_stats()
+
+    for stream_id in (1, 3):
+        mock_server.c.send_headers(stream_id, [(':status', '200')])
+        for _ in range(8):
+            mock_server.c.send_data(stream_id, b'x' * 4000)
+    await mock_server.flush()
+    await conn.read()
+    # 64 kB of DATA (in 16 frames) acknowledged at once: a single connection-level WINDOW_UPDATE.
+    assert mock_server.get_client_stats() == """
+      writes=1 bytes=13 records=1
+      WINDOW_UPDATE=1
+    """
+
+    mock_server.c.end_stream(1)
+    mock_server.c.end_stream(3)
+    await mock_server.flush()
+    assert len((await stream1.wait()).body) == len((await stream3.wait()).body) == 32000
+
+
+async def test_read_batch_resume():
+    """Verify streams whose windows open several times in one batch each send once, in one write."""
+
+    settings = {h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: 0}
+    async with nh2.mock.expect_connect('example.com', 443, settings=settings) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    await mock_server.read()
+    await conn.read()  # The server's settings (so every stream's window starts closed).
+    await conn.read()  # The server's acknowledgment of the client's settings.
+    for _ in range(2):
+        await conn.request('POST', '/upload', body=bytes(300))
+    # The headers are sent even though none of the body fits yet.
+    while len(mock_server.c.streams) < 2:
+        await mock_server.read()
+    mock_server.get_client_stats()
+
+    for stream_id in (1, 3):
+        for _ in range(3):
+            mock_server.c.increment_flow_control_window(100, stream_id=stream_id)
+    await mock_server.flush()
+    await conn.read()
+    assert mock_server.get_client_stats() == """
+      writes=1 bytes=618 records=1
+      DATA=2
+      stream 1: DATA=1
+      stream 3: DATA=1
+    """
+
+
+async def test_read_unknown_streams():
+    """Verify events for streams that are no longer tracked are tolerated (and not sent on)."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream = await conn.request('POST', '/upload', body=bytes(100000))
+    await conn.request('GET', '/forgotten')
+    del conn.streams[3]
+    await mock_server.read()
+    while 'StreamEnded' not in await mock_server.read():
+        pass
+
+    # The upload is stuck waiting for its window to open, but the server opens it and then resets
+    # the stream in the same batch.
+    mock_server.c.increment_flow_control_window(100000)
+    mock_server.c.increment_flow_control_window(100000, stream_id=1)
+    mock_server.c.reset_stream(1)
+    mock_server.c.send_headers(3, [(':status', '200')])
+    for _ in range(4):
+        mock_server.c.send_data(3, b'x' * 10000)
+    mock_server.c.end_stream(3)
+    await mock_server.flush()
+    with pytest.raises(nh2.connection.StreamResetError):
+        await stream.wait()
+    assert not conn.streams
+    # The forgotten stream's data was still acknowledged, reopening the connection's window.
+    assert conn.c.inbound_flow_control_window == 65535
@@ -0,0 +1,129 @@
+"""Tests for nh2.framing."""
+
+import zlib
+
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.framing
+import nh2.mock
+import nh2.rex
+
+pytestmark = pytest.mark.anyio
+
+
+def test_encode():
+    """Verify the length prefix."""
+
+    assert nh2.framing.encode(b'abc') == b'\x00\x00\x00\x00\x03abc'
+    assert nh2.framing.encode(b'') == b'\x00\x00\x00\x00\x00'
+    compressed = nh2.framing.encode(b'abc', compress=zlib.compress)
+    assert compressed[:1] == b'\x01'
+    assert zlib.decompress(compressed[5:]) == b'abc'
+
+
+def test_decoder():
+    """Verify messages are split correctly however the stream is chunked."""
+
+    body = (nh2.framing.encode(b'first') + nh2.framing.encode(b'') +
+            nh2.framing.encode(b'third', compress=zlib.compress))
+    for size in (1, 3, len(body)):
+        decoder = nh2.framing.MessageDecoder(decompress=zlib.decompress)
+        messages = []
+        for i in range(0, len(body), size):
+            messages.extend(decoder.feed(body[i:i + size]))
+        assert messages == [b'first', b'', b'third']
+        decoder.close()
+
+
+def test_decoder_errors():
+    """Verify oversized, undecompressable, and truncated messages are rejected."""
+
+    with pytest.raises(ValueError):
+        nh2.framing.MessageDecoder(max_length=3).feed(nh2.framing.encode(b'abcd'))
+
+    with pytest.raises(ValueError):
+        nh2.framing.MessageDecoder().feed(nh2.framing.encode(b'abc', compress=zlib.compress))
+
+    decoder = nh2.framing.MessageDecoder()
+    assert not decoder.feed(nh2.framing.encode(b'abc')[:-1])
+    with pytest.raises(ValueError):
+        decoder.close()
+
+
+async def test_bidirectional():
+    """Verify messages flow both ways over one open stream, with trailers in both directions."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    request = nh2.rex.Request('POST',
+                              'example.com',
+                              '/echo.Echo/Stream',
+                              headers={
+                                  'content-type': 'application/grpc',
+                                  'te': 'trailers',
+                              })
+    stream = await conn.send(request, end_stream=False)
+    await nh2.framing.send_message(stream, b'ping')
+    assert 'RemoteSettingsChanged' in await mock_server.read()
+    assert 'RequestReceived' in await mock_server.read()
+    assert await mock_server.read() == r"""
+      - [DataReceived stream_id=1 data=b'\x00\x00\x00\x00\x04ping' flow_controlled_length=9 stream_ended=None]
+    """
+
+    mock_server.c.send_headers(1, [(':status', '200'), ('content-type', 'application/grpc')])
+    mock_server.c.send_data(1, nh2.framing.encode(b'pong'))
+    await mock_server.flush()
+    messages = nh2.framing.iter_messages(stream)
+    assert await messages.__anext__() == b'pong'
+
+    await stream.end({'x-client-done': '1'})
+    assert 'SettingsAcknowledged' in await mock_server.read()
+    assert await mock_server.read() == """
+      - [TrailersReceived]
+        stream_id: 1
+        headers:
+          - ('x-client-done', '1')
+        stream_ended: [StreamEnded stream_id=1]
+        priority_updated: None
+      - [StreamEnded stream_id=1]
+    """
+
+    mock_server.c.send_data(1, nh2.framing.encode(b'bye'))
+    mock_server.c.send_headers(1, [('grpc-status', '0')], end_stream=True)
+    await mock_server.flush()
+    assert [message async for message in messages] == [b'bye']
+    response = await stream.wait()
+    assert response.trailers == {'grpc-status': '0'}
+
+
+async def test_write_after_response():
+    """Verify a write stuck behind the window fails once the server sends its whole response."""
+
+    request = nh2.rex.Request('POST', 'example.com', '/upload')
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream = await conn.send(request, end_stream=False)
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(_catch, stream.write(b'x' * 200000))
+        while 'RequestReceived' not in await mock_server.read():
+            pass
+        mock_server.c.send_headers(1, [(':status', '413')], end_stream=True)
+        await mock_server.flush()
+        error = await future
+
+    assert isinstance(error, nh2.connection.StreamEndedError)
+    assert error.response.status == 413
+    assert (await stream.wait()).status == 413
+    with pytest.raises(nh2.connection.StreamEndedError):
+        await stream.write(b'more')
+
+
+async def _catch(coro):
+    try:
+        await coro
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return e
+    return None
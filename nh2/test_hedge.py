@@ -0,0 +1,147 @@
+"""Tests for nh2.hedge."""
+
+import io
+
+import anyio
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.hedge
+import nh2.limiter
+import nh2.mock
+import nh2.rex
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_get_delay():
+    """Verify the hedging delay tracks the configured percentile of recent latencies."""
+
+    assert nh2.hedge.Hedger(delay=.5).get_delay() == .5
+
+    hedger = nh2.hedge.Hedger(percentile=90, history=10, initial_delay=2)
+    assert hedger.get_delay() == 2
+    hedger.latencies.extend(range(20, 0, -1))
+    assert hedger.get_delay() == 9
+    hedger.percentile = 50
+    assert hedger.get_delay() == 5
+    hedger.percentile = 100
+    assert hedger.get_delay() == 10
+    hedger.percentile = 0
+    assert hedger.get_delay() == 1
+
+
+async def test_not_idempotent():
+    """Verify requests that aren't safe (or possible) to send twice are refused."""
+
+    request = nh2.rex.Request('POST', 'example.com', '/test')
+    with pytest.raises(ValueError):
+        await nh2.hedge.Hedger().send([], request)
+
+    request = nh2.rex.Request('PUT', 'example.com', '/test', body=io.BytesIO(b'data'))
+    with pytest.raises(ValueError):
+        await nh2.hedge.Hedger().send([], request)
+
+
+async def _read_until(mock_server, text):
+    events = ''
+    while text not in events:
+        events = await mock_server.read()
+    return events
+
+
+async def test_hedge():
+    """Verify a slow request is duplicated on the second connection, and the loser is reset."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as slow_server:
+        slow = await nh2.connection.Connection('example.com', 443)
+    async with nh2.mock.expect_connect('example.com', 443) as fast_server:
+        fast = await nh2.connection.Connection('example.com', 443)
+
+    hedger = nh2.hedge.Hedger(delay=.01)
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(hedger.send, [slow, fast], request)
+
+        await _read_until(slow_server, 'RequestReceived')
+        await _read_until(fast_server, 'RequestReceived')
+        fast_server.c.send_headers(1, [(':status', '200')])
+        fast_server.c.send_data(1, b'fast response', end_stream=True)
+        await fast_server.flush()
+
+        response = await future
+
+    assert response.body == 'fast response'
+    assert len(hedger.latencies) == 1
+    assert not slow.streams
+    assert not fast.streams
+    assert 'StreamReset' in await _read_until(slow_server, 'StreamReset')
+
+
+async def test_hedge_not_needed():
+    """Verify a request that finishes within the delay is only sent once."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    hedger = nh2.hedge.Hedger(delay=60)
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(hedger.send, [conn, conn], request)
+
+        await _read_until(mock_server, 'RequestReceived')
+        mock_server.c.send_headers(1, [(':status', '200')], end_stream=True)
+        await mock_server.flush()
+
+        response = await future
+
+    assert response.status == 200
+    assert conn.c.get_next_available_stream_id() == 3
+
+
+async def test_hedge_limited():
+    """Verify a hedged request stuck behind a full limiter can be cancelled, and isn't sent."""
+
+    limiter = nh2.limiter.Limiter(initial=1)
+    async with nh2.mock.expect_connect('example.com', 443):
+        conn = await nh2.connection.Connection('example.com', 443, limiter=limiter)
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    await limiter.acquire(request)
+
+    with pytest.raises(TimeoutError):
+        with anyio.fail_after(.05):
+            await nh2.hedge.Hedger(delay=.01).send([conn, conn], request)
+    assert not limiter.waiters
+    assert limiter.inflight == 1
+    assert not conn.streams
+    assert conn.c.get_next_available_stream_id() == 1
+
+
+async def test_hedge_loser_queued():
+    """Verify a duplicate still waiting for its limiter when the original finishes is never sent."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    limiter = nh2.limiter.Limiter(initial=1)
+    async with nh2.mock.expect_connect('example.com', 443):
+        limited = await nh2.connection.Connection('example.com', 443, limiter=limiter)
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    await limiter.acquire(request)
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(nh2.hedge.Hedger(delay=0).send, [conn, limited], request)
+
+        await _read_until(mock_server, 'RequestReceived')
+        while not limiter.waiters:
+            await anyio.sleep(0)
+        mock_server.c.send_headers(1, [(':status', '200')], end_stream=True)
+        await mock_server.flush()
+
+        response = await future
+
+    assert response.status == 200
+    assert not limiter.waiters
+    limiter.discard()
+    assert limiter.inflight == 0
+    assert limited.c.get_next_available_stream_id() == 1
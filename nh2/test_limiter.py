@@ -0,0 +1,167 @@
+"""Tests for nh2.limiter."""
+
+import anyio
+import h2.errors
+import h2.settings
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.limiter
+import nh2.mock
+import nh2.rex
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_token_bucket():
+    """Verify requests beyond the burst are spaced out at the given rate."""
+
+    bucket = nh2.limiter.TokenBucket(100, burst=2)
+    start = anyio.current_time()
+    await bucket.acquire()
+    await bucket.acquire()
+    assert anyio.current_time() - start < .01
+    await bucket.acquire()
+    assert anyio.current_time() - start >= .009
+
+
+async def test_limiter_aimd():
+    """Verify the limit grows with fast completions and shrinks with slow or dropped ones."""
+
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    limiter = nh2.limiter.Limiter(initial=2, latency_threshold=1)
+
+    await limiter.acquire(request)
+    await limiter.acquire(request)
+    assert limiter.inflight == 2
+    limiter.release(.1)
+    assert limiter.limit == 2.5
+    limiter.release(.1)
+    assert limiter.limit == 2.5
+    assert limiter.inflight == 0
+
+    await limiter.acquire(request)
+    limiter.release(5)
+    assert limiter.limit == 2.25
+    # This started before the limit was decreased, so it's part of the same congestion event.
+    await limiter.acquire(request)
+    limiter.release(.1, dropped=True)
+    assert limiter.limit == 2.25
+    await anyio.sleep(.2)
+    await limiter.acquire(request)
+    limiter.release(.1, dropped=True)
+    assert limiter.limit == 2.025
+
+    limiter = nh2.limiter.Limiter(initial=1, minimum=1)
+    await limiter.acquire(request)
+    limiter.release(0, dropped=True)
+    assert limiter.limit == 1
+
+
+async def test_limiter_queue():
+    """Verify requests beyond the limit wait their turn, and are shed once the queue is full."""
+
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    limiter = nh2.limiter.Limiter(initial=1, max_queued=1)
+    admitted = []
+
+    async def acquire(name):
+        await limiter.acquire(request)
+        admitted.append(name)
+
+    await limiter.acquire(request)
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(acquire, 'queued')
+        await anyio.sleep(.01)
+        assert not admitted
+        assert len(limiter.waiters) == 1
+
+        with pytest.raises(nh2.limiter.Overloaded):
+            await limiter.acquire(request)
+
+        limiter.discard()
+    assert admitted == ['queued']
+    assert limiter.inflight == 1
+    assert not limiter.waiters
+
+
+async def test_limiter_cancelled():
+    """Verify a queued request that's cancelled gives up its place in line."""
+
+    request = nh2.rex.Request('GET', 'example.com', '/test')
+    limiter = nh2.limiter.Limiter(initial=1)
+
+    await limiter.acquire(request)
+    with anyio.move_on_after(.01):
+        await limiter.acquire(request)
+    assert not limiter.waiters
+    limiter.discard()
+    assert limiter.inflight == 0
+
+
+async def test_limiter_connection():
+    """Verify Connection.send consults its limiter, and a burst of refusals shrinks it only once."""
+
+    limiter = nh2.limiter.Limiter(initial=4)
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443, limiter=limiter)
+
+    streams = [await conn.request('GET', f'/{i}') for i in range(4)]
+    assert limiter.inflight == 4
+    while len(mock_server.c.streams) < 4:
+        await mock_server.read()
+
+    mock_server.c.send_headers(1, [(':status', '503')], end_stream=True)
+    for stream_id in (3, 5, 7):
+        mock_server.c.reset_stream(stream_id, error_code=h2.errors.ErrorCodes.REFUSED_STREAM)
+    await mock_server.flush()
+
+    response = await streams[0].wait()
+    assert response.status == 503
+    for stream in streams[1:]:
+        with pytest.raises(nh2.connection.StreamResetError) as excinfo:
+            await stream.wait()
+        assert excinfo.value.error_code == h2.errors.ErrorCodes.REFUSED_STREAM
+    assert not conn.streams
+    assert limiter.inflight == 0
+    assert limiter.limit == pytest.approx(4 * .9)
+
+    # A request sent after that backoff can trigger another.
+    await anyio.sleep(.01)
+    stream = await conn.request('GET', '/4')
+    while 9 not in mock_server.c.streams:
+        await mock_server.read()
+    mock_server.c.reset_stream(9, error_code=h2.errors.ErrorCodes.REFUSED_STREAM)
+    await mock_server.flush()
+    with pytest.raises(nh2.connection.StreamResetError):
+        await stream.wait()
+    assert limiter.limit == pytest.approx(4 * .9 * .9)
+
+
+async def test_limiter_tunnels():
+    """Verify a stream left open (like a WebSocket) only holds its slot until it's answered."""
+
+    limiter = nh2.limiter.Limiter(initial=1)
+    settings = {h2.settings.SettingCodes.ENABLE_CONNECT_PROTOCOL: 1}
+    async with nh2.mock.expect_connect('example.com', 443, settings=settings) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443, limiter=limiter)
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(conn.connect, 'websocket', '/chat')
+        while 1 not in mock_server.c.streams:
+            await mock_server.read()
+        assert limiter.inflight == 1
+        mock_server.c.send_headers(1, [(':status', '200')])
+        await mock_server.flush()
+        tunnel = await future
+    await tunnel.wait_headers()
+    assert limiter.inflight == 0
+    assert limiter.limit == 2  # Accepted, so it counts as a successful request.
+
+    with anyio.fail_after(1):
+        stream = await conn.request('GET', '/')
+    assert limiter.inflight == 1
+    await stream.cancel()
+    await tunnel.cancel()
+    assert limiter.inflight == 0
@@ -130,3 +130,129 @@ async def test_opaque_workflow():
         await mock_server.flush()
 
         assert await future == 'finished'
+
+
+async def test_wire_stats():
+    """Verify writes, bytes, and frames are counted per connection and per stream."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream = await conn.request('GET', '/dummy')
+    await mock_server.read()
+    await mock_server.read()
+    mock_server.c.send_headers(1, [(':status', '200')])
+    mock_server.c.send_data(1, b'dummy response', end_stream=True)
+    await mock_server.flush()
+    await stream.wait()
+
+    # Client sends its preface and settings on connect, then the request, then its settings ack.
+    mock_server.client_stats.assert_at_most(writes=3, HEADERS=1, DATA=0, WINDOW_UPDATE=0)
+    assert mock_server.get_client_stats() == """
+      writes=3 bytes=112 records=3
+      HEADERS=1 SETTINGS=2
+      stream 1: HEADERS=1
+    """
+    assert mock_server.get_client_stats() == """
+      writes=0 bytes=0 records=0
+    """
+
+    with pytest.raises(AssertionError) as excinfo:
+        mock_server.server_stats.assert_at_most(writes=3, DATA=0)
+    assert str(excinfo.value) == 'Too many: DATA=1 (limit 0)'
+    mock_server.server_stats.assert_at_most(stream_id=1, HEADERS=1, DATA=1, SETTINGS=0)
+    mock_server.server_stats.assert_at_most(stream_id=3, HEADERS=0, DATA=0)
+    with pytest.raises(AssertionError) as excinfo:
+        mock_server.server_stats.assert_at_most(stream_id=1, DATA=0)
+    assert str(excinfo.value) == 'Too many on stream 1: DATA=1 (limit 0)'
+    with pytest.raises(TypeError):
+        mock_server.server_stats.assert_at_most(stream_id=1, writes=3)
+    assert mock_server.get_server_stats() == """
+      writes=3 bytes=93 records=3
+      DATA=1 HEADERS=1 SETTINGS=2
+      stream 1: DATA=1 HEADERS=1
+    """
+
+
+def test_wire_stats_split_frames():
+    """Verify frames (and the client preface) split across writes are still counted once."""
+
+    stats = nh2.mock.WireStats(client=True)
+    data = (b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n' + b'\x00\x00\x00\x04\x00\x00\x00\x00\x00' +
+            b'\x00\x00\x03\x00\x01\x00\x00\x00\x03abc')
+    for i in range(0, len(data), 5):
+        stats.record(data[i:i + 5])
+    stats.assert_at_most(writes=len(range(0, len(data), 5)), SETTINGS=1, DATA=1)
+    assert stats.pop() == """
+      writes=9 bytes=45 records=9
+      DATA=1 SETTINGS=1
+      stream 3: DATA=1
+    """
+
+
+async def test_record_replay(monkeypatch, tmp_path):
+    """Verify a session recorded from a live server can be replayed in any order."""
+
+    recording = tmp_path / 'recordings' / 'session.json'
+    backend = await nh2.mock.MockServer('example.com', 443)
+
+    async def connect_tcp(*unused_args, **unused_kwargs):
+        return backend.client_pipe_end
+
+    monkeypatch.setattr(nh2.connection.anyio, 'connect_tcp', connect_tcp)
+    async with nh2.mock.expect_connect('example.com', 443, live=True, recording=recording):
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream1 = await conn.request('GET', '/a')
+    stream3 = await conn.request('POST', '/b', json={'x': 1})
+    await backend.read()
+    await backend.read()
+    await backend.read()
+    backend.c.send_headers(1, [(':status', '200')])
+    backend.c.send_data(1, b'aaa', end_stream=True)
+    backend.c.send_headers(3, [(':status', '201'), ('x-b', 'b')])
+    backend.c.send_data(3, b'bbb')
+    backend.c.send_headers(3, [('x-t', '1')], end_stream=True)
+    await backend.flush()
+    assert (await stream1.wait()).body == 'aaa'
+    assert (await stream3.wait()).body == 'bbb'
+    await conn.close()
+    assert recording.exists()
+
+    backend = None  # Replaying must not touch the network (or the backend).
+    async with nh2.mock.expect_connect('example.com', 443, recording=recording) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    assert isinstance(mock_server, nh2.mock.ReplayServer)
+    stream1 = await conn.request('POST', '/b', json={'x': 1}, headers={'x-extra': '1'})
+    stream3 = await conn.request('GET', '/a')
+    response = await stream1.wait()
+    assert (response.status, response.headers['x-b'], response.body) == (201, 'b', 'bbb')
+    assert response.trailers == {'x-t': '1'}
+    response = await stream3.wait()
+    assert (response.status, response.body) == (200, 'aaa')
+
+    with pytest.raises(AssertionError) as excinfo:
+        await conn.request('GET', '/a')
+    assert str(excinfo.value) == 'No recorded response to GET /a'
+
+
+async def test_record_unclosed(monkeypatch, tmp_path):
+    """Verify a session that fails before the connection is closed is still recorded."""
+
+    recording = tmp_path / 'session.json'
+    backend = await nh2.mock.MockServer('example.com', 443)
+
+    async def connect_tcp(*unused_args, **unused_kwargs):
+        return backend.client_pipe_end
+
+    monkeypatch.setattr(nh2.connection.anyio, 'connect_tcp', connect_tcp)
+    with pytest.raises(RuntimeError):
+        async with nh2.mock.expect_connect('example.com', 443, live=True, recording=recording):
+            conn = await nh2.connection.Connection('example.com', 443)
+            await conn.request('GET', '/a')
+            assert not recording.exists()
+            raise RuntimeError('Failed before conn.close()')
+    assert recording.exists()
+
+    backend = None  # Replaying must not touch the network (or the backend).
+    async with nh2.mock.expect_connect('example.com', 443, recording=recording) as mock_server:
+        await nh2.connection.Connection('example.com', 443)
+    assert isinstance(mock_server, nh2.mock.ReplayServer)
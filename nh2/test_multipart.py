@@ -0,0 +1,119 @@
+"""Tests for nh2.multipart."""
+
+import io
+
+import h2.events
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.mock
+import nh2.multipart
+import nh2.rex
+
+pytestmark = pytest.mark.anyio
+
+
+def _read_all(body, size):
+    pieces = []
+    while (data := body.read(size)):
+        assert len(data) <= size
+        pieces.append(data)
+    return b''.join(pieces)
+
+
+def test_multipart(tmp_path):
+    """Verify the encoded body, and that it's the same however it's read."""
+
+    path = tmp_path / 'upload.txt'
+    path.write_bytes(b'file contents')
+    expected = (b'--xyz\r\n'
+                b'content-disposition: form-data; name="field"\r\n'
+                b'\r\n'
+                b'\xe2\x80\xa2\r\n'
+                b'--xyz\r\n'
+                b'content-disposition: form-data; name="upload"; filename="upload.txt"\r\n'
+                b'content-type: text/plain\r\n'
+                b'\r\n'
+                b'file contents\r\n'
+                b'--xyz\r\n'
+                b'content-disposition: form-data; name="a%22b"; filename="data.bin"\r\n'
+                b'content-type: application/octet-stream\r\n'
+                b'\r\n'
+                b'\x00\x01\r\n'
+                b'--xyz--\r\n')
+
+    for size in (1, 5, 1000):
+        body = nh2.multipart.Multipart('xyz')
+        body.add_field('field', '•')
+        body.add_file('upload', path, contenttype='text/plain')
+        body.add_file('a"b', io.BytesIO(b'\x00\x01'), filename='data.bin')
+        assert body.length == len(expected)
+        assert _read_all(body, size) == expected
+
+
+def test_multipart_unknown_length():
+    """Verify a part of unknown length leaves the body's length unknown."""
+
+    class Unsized:  # pylint: disable=missing-class-docstring,missing-function-docstring
+
+        def __init__(self):
+            self.data = b'abc'
+
+        def read(self, size):
+            data, self.data = self.data[:size], self.data[size:]
+            return data
+
+    body = nh2.multipart.Multipart('xyz')
+    body.add_file('upload', Unsized())
+    assert body.length is None
+    assert b'\r\nabc\r\n--xyz--\r\n' in _read_all(body, 2)
+
+    request = nh2.rex.Request('POST', 'example.com', '/upload', body=body)
+    assert 'content-length' not in request.headers
+
+
+def test_request():
+    """Verify a Multipart body sets the request's content-type and content-length."""
+
+    body = nh2.multipart.Multipart('xyz')
+    body.add_field('a', 'b')
+    request = nh2.rex.Request('POST', 'example.com', '/upload', body=body)
+    assert request.body is body
+    assert request.headers['content-type'] == 'multipart/form-data; boundary=xyz'
+    assert request.headers['content-length'] == str(body.length)
+
+
+async def test_upload():
+    """Verify a body larger than the flow-control window is streamed as the window opens."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    contents = bytes(range(256)) * 1000
+    body = nh2.multipart.Multipart('xyz')
+    body.add_file('upload', io.BytesIO(contents), filename='data.bin')
+    length = body.length
+    stream = await conn.request('POST', '/upload', body=body)
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(stream.wait)
+
+        received = []
+        ended = False
+        while not ended:
+            for event in mock_server.c.receive_data(await mock_server.s.receive()):
+                if isinstance(event, h2.events.DataReceived):
+                    received.append(event.data)
+                    mock_server.c.acknowledge_received_data(event.flow_controlled_length, 1)
+                elif isinstance(event, h2.events.StreamEnded):
+                    ended = True
+            await mock_server.flush()
+
+        mock_server.c.send_headers(1, [(':status', '200')], end_stream=True)
+        await mock_server.flush()
+        assert (await future).status == 200
+
+    received = b''.join(received)
+    assert len(received) == length > 65535
+    assert contents in received
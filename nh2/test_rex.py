@@ -89,3 +89,17 @@ def test_response_json():
     response = nh2.rex.Response(request, {':status': '200'}, b'{"a": "\\u2022 \xe2\x80\xa2"}')
     assert response.body == b'{"a": "\\u2022 \xe2\x80\xa2"}'
     assert response.json() == {'a': '\u2022 \u2022'}
+
+
+def test_trailers():
+    """Verify trailers are carried by both Requests and Responses."""
+
+    request = nh2.rex.Request('POST', 'example.com', '/test')
+    assert not request.trailers
+    request = nh2.rex.Request('POST', 'example.com', '/test', trailers=[('x-checksum', 'abc')])
+    assert request.trailers == {'x-checksum': 'abc'}
+
+    response = nh2.rex.Response(request, {':status': '200'}, b'')
+    assert not response.trailers
+    response = nh2.rex.Response(request, {':status': '200'}, b'', trailers={'grpc-status': '0'})
+    assert response.trailers == {'grpc-status': '0'}
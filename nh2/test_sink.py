@@ -0,0 +1,171 @@
+"""Tests for nh2.sink."""
+
+import io
+
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.mock
+import nh2.sink
+
+pytestmark = pytest.mark.anyio
+
+
+def test_buffer_sink():
+    """Verify bytearrays are preallocated when possible, and trimmed to the actual body."""
+
+    sink = nh2.sink.open_sink(None, 6)
+    assert len(sink.buffer) == 6
+    sink.write(b'abc')
+    sink.write(b'def')
+    assert sink.close() == bytearray(b'abcdef')
+
+    buffer = bytearray(b'xxxxxxxxxx')
+    sink = nh2.sink.open_sink(buffer, None)
+    sink.write(b'abc')
+    assert sink.close() is buffer
+    assert buffer == b'abc'
+
+    buffer = bytearray(b'x')
+    sink = nh2.sink.open_sink(buffer, 3)
+    sink.write(b'ab')
+    sink.write(b'cd')
+    assert sink.close() == b'abcd'
+
+
+def test_file_sink(tmp_path):
+    """Verify empty read-write files are memory-mapped (and trimmed), and others are appended to."""
+
+    with open(tmp_path / 'mapped', 'w+b') as fobj:
+        sink = nh2.sink.open_sink(fobj, 6)
+        assert sink.mmap is not None
+        sink.write(b'abc')
+        sink.write(b'def')
+        body = sink.close()
+        assert body[:] == b'abcdef'
+        assert fobj.tell() == 6
+        body.close()
+    assert (tmp_path / 'mapped').read_bytes() == b'abcdef'
+
+    # A body shorter than its content-length (like a HEAD response's empty one) is trimmed.
+    with open(tmp_path / 'short', 'w+b') as fobj:
+        sink = nh2.sink.open_sink(fobj, 6)
+        sink.write(b'abc')
+        body = sink.close()
+        assert body[:] == b'abc'
+        assert fobj.tell() == 3
+        body.close()
+    assert (tmp_path / 'short').read_bytes() == b'abc'
+
+    with open(tmp_path / 'empty', 'w+b') as fobj:
+        sink = nh2.sink.open_sink(fobj, 1000)
+        assert sink.close() is fobj
+        assert fobj.tell() == 0
+    assert (tmp_path / 'empty').read_bytes() == b''
+
+    with open(tmp_path / 'written', 'wb') as fobj:
+        sink = nh2.sink.open_sink(fobj, 6)
+        assert sink.mmap is None
+        sink.write(b'abc')
+        sink.write(b'def')
+        assert sink.close() is fobj
+    assert (tmp_path / 'written').read_bytes() == b'abcdef'
+
+    fobj = io.BytesIO(b'prefix ')
+    fobj.seek(0, io.SEEK_END)
+    sink = nh2.sink.open_sink(fobj, 3)
+    sink.write(b'abc')
+    assert sink.close() is fobj
+    assert fobj.getvalue() == b'prefix abc'
+
+
+async def test_read_into(tmp_path):
+    """Verify Stream.read_into writes each DATA frame into the sink, and returns it as the body."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    contents = bytes(range(256)) * 100
+    for i in range(3):
+        stream = await conn.request('GET', f'/download/{i}')
+        await mock_server.read()
+        await mock_server.read()
+        stream_id = 1 + i * 2
+        mock_server.c.send_headers(stream_id, [(':status', '200'),
+                                               ('content-length', str(len(contents)))])
+        for pos in range(0, len(contents), 10000):
+            mock_server.c.send_data(stream_id, contents[pos:pos + 10000])
+        mock_server.c.end_stream(stream_id)
+        await mock_server.flush()
+
+        if i == 0:
+            response = await stream.read_into()
+            assert isinstance(response.body, bytearray)
+            assert response.body == contents
+        elif i == 1:
+            with open(tmp_path / 'download', 'w+b') as fobj:
+                response = await stream.read_into(fobj)
+                assert response.body[:] == contents
+                response.body.close()
+            assert (tmp_path / 'download').read_bytes() == contents
+        else:
+            fobj = io.BytesIO()
+            response = await stream.read_into(fobj)
+            assert response.body is fobj
+            assert fobj.getvalue() == contents
+        assert not stream.received_data
+
+
+async def test_concurrent_downloads():
+    """Verify binary bodies that end while another task is reading don't break the connection."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    contents = bytes(range(256)) * 60  # All three fit in the connection's window.
+    fobj = io.BytesIO()
+    first = await conn.request('GET', '/download/1', sink=bytearray())
+    second = await conn.request('GET', '/download/2', sink=fobj)
+    unsunk = await conn.request('GET', '/download/3')
+    while len(mock_server.c.streams) < 3:
+        await mock_server.read()
+    for stream_id in (1, 3, 5):
+        mock_server.c.send_headers(stream_id, [(':status', '200')])
+    for pos in range(0, len(contents), 5000):
+        for stream_id in (1, 3, 5):
+            mock_server.c.send_data(stream_id, contents[pos:pos + 5000])
+    for stream_id in (1, 3, 5):
+        mock_server.c.end_stream(stream_id)
+    await mock_server.flush()
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(first.read_into)
+        # This runs the read loop until all three streams have ended.
+        assert (await second.read_into()).body is fobj
+        assert (await future).body == contents
+    assert fobj.getvalue() == contents
+
+    with pytest.raises(UnicodeDecodeError):
+        await unsunk.wait()
+    assert (await unsunk.read_into()).body == contents
+
+    with pytest.raises(ValueError):
+        await first.read_into(bytearray())
+
+
+async def test_read_into_head(tmp_path):
+    """Verify a HEAD response's content-length doesn't leave a file full of zeros."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    with open(tmp_path / 'download', 'w+b') as fobj:
+        stream = await conn.request('HEAD', '/download', sink=fobj)
+        while 1 not in mock_server.c.streams:
+            await mock_server.read()
+        mock_server.c.send_headers(1, [(':status', '200'), ('content-length', '1000')],
+                                   end_stream=True)
+        await mock_server.flush()
+        assert (await stream.read_into()).body is fobj
+    assert (tmp_path / 'download').read_bytes() == b''
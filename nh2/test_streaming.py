@@ -0,0 +1,147 @@
+"""Tests for nh2.streaming."""
+
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.mock
+import nh2.streaming
+
+pytestmark = pytest.mark.anyio
+
+
+def _event_tuples(events):
+    return [(event.event, event.data, event.id, event.retry) for event in events]
+
+
+def test_sse_decoder():
+    """Verify events are parsed correctly however the body is split into chunks."""
+
+    body = (b'\xef\xbb\xbf: comment\r\n'
+            b'data: first\r\n\r\n'
+            b'event: update\rid: 7\rdata:line 1\rdata: line 2\r\r'
+            b'retry: 250\ndata\n\n'
+            b'\n'
+            b'data: incomplete')
+    expected = [
+        ('message', 'first', None, None),
+        ('update', 'line 1\nline 2', '7', None),
+        ('message', '', '7', 250),
+    ]
+
+    decoder = nh2.streaming.SSEDecoder()
+    assert _event_tuples(decoder.feed(body)) == expected
+    decoder.close()
+
+    for size in (1, 2, 3, 7):
+        decoder = nh2.streaming.SSEDecoder()
+        events = []
+        for i in range(0, len(body), size):
+            events.extend(decoder.feed(body[i:i + size]))
+        assert _event_tuples(events) == expected
+
+
+def test_ndjson_decoder():
+    """Verify records split across chunks are reassembled, and a final unterminated one is kept."""
+
+    body = b'{"a": 1}\r\n\n[2, 3]\n"\xe2\x80\xa2"\n{"b": 4}'
+    for size in (1, 4, len(body)):
+        decoder = nh2.streaming.NDJSONDecoder()
+        records = []
+        for i in range(0, len(body), size):
+            records.extend(decoder.feed(body[i:i + size]))
+        assert records == [{'a': 1}, [2, 3], '•']
+        assert decoder.close() == [{'b': 4}]
+
+
+async def _start(path):
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    stream = await conn.request('GET', path)
+    await mock_server.read()
+    await mock_server.read()
+    mock_server.c.send_headers(1, [(':status', '200'), ('content-type', 'text/event-stream')])
+    await mock_server.flush()
+    return mock_server, stream
+
+
+async def test_iter_events():
+    """Verify events are delivered as soon as their DATA frames arrive."""
+
+    mock_server, stream = await _start('/events')
+    assert (await stream.wait_headers())[':status'] == '200'
+
+    events = nh2.streaming.iter_events(stream)
+    mock_server.c.send_data(1, b'data: one\n\nda')
+    await mock_server.flush()
+    event = await events.__anext__()
+    assert event.data == 'one'
+
+    mock_server.c.send_data(1, b'ta: two\n')
+    mock_server.c.send_data(1, b'\n', end_stream=True)
+    await mock_server.flush()
+    assert [event.data async for event in events] == ['two']
+
+    response = await stream.wait()
+    assert response.status == 200
+    assert response.body == ''
+
+
+async def test_iter_ndjson_flow_control():
+    """Verify data is only acknowledged to the server once it has been consumed."""
+
+    mock_server, stream = await _start('/records')
+    records = nh2.streaming.iter_ndjson(stream)
+    mock_server.c.send_data(1, b'[1]\n[2]\n')
+    await mock_server.flush()
+    assert await records.__anext__() == [1]
+    assert stream.unacknowledged == 8
+    assert await records.__anext__() == [2]
+
+    mock_server.c.send_data(1, b'[3]', end_stream=True)
+    await mock_server.flush()
+    assert [record async for record in records] == [[3]]
+    assert stream.unacknowledged == 0
+
+
+async def test_unconsumed_stream_doesnt_stall_others():
+    """Verify a stream nobody is consuming only holds back its own window, not the connection's."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+    idle = await conn.request('GET', '/idle')
+    busy = await conn.request('GET', '/busy')
+    while len(mock_server.c.streams) < 2:
+        await mock_server.read()
+
+    mock_server.c.send_headers(1, [(':status', '200')])
+    for _ in range(3):
+        mock_server.c.send_data(1, bytes(16384))
+    mock_server.c.send_data(1, bytes(16383))
+    await mock_server.flush()
+    next_chunk = idle.iter_data().__anext__
+    assert await next_chunk() == bytes(16384)
+    assert idle.unacknowledged == 65535
+
+    while 'WindowUpdated stream_id=0' not in await mock_server.read():
+        pass
+    assert mock_server.c.local_flow_control_window(1) == 0
+    assert mock_server.c.local_flow_control_window(3) == 65535
+
+    mock_server.c.send_headers(3, [(':status', '200')])
+    for _ in range(4):
+        mock_server.c.send_data(3, b'x' * 16000)
+    mock_server.c.end_stream(3)
+    await mock_server.flush()
+    assert len((await busy.wait()).body) == 64000
+
+    # Consuming the idle stream's data reopens its own window.
+    assert len(b''.join([await next_chunk() for _ in range(3)])) == 49151
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(next_chunk)
+        while 'WindowUpdated stream_id=1 delta=65535' not in await mock_server.read():
+            pass
+        assert mock_server.c.local_flow_control_window(1) == 65535
+        mock_server.c.send_data(1, b'done', end_stream=True)
+        await mock_server.flush()
+        assert await future == b'done'
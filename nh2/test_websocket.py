@@ -0,0 +1,198 @@
+"""Tests for nh2.websocket."""
+
+import functools
+
+import h2.events
+import h2.settings
+import pytest
+
+import nh2.anyio_util
+import nh2.connection
+import nh2.mock
+import nh2.websocket
+
+pytestmark = pytest.mark.anyio
+
+
+def test_frames():
+    """Verify frames of every length encoding survive a round trip, however they're chunked."""
+
+    payloads = [b'', b'a' * 125, b'b' * 126, b'c' * 0xffff, bytes(range(256)) * 300]
+    for mask_key in (b'\x01\x02\x03\x04', None):
+        data = b''.join(
+            nh2.websocket.encode_frame(nh2.websocket.BINARY, payload, mask_key=mask_key)
+            for payload in payloads)
+        data += nh2.websocket.encode_frame(nh2.websocket.TEXT, b'end', fin=False, mask_key=mask_key)
+        for size in (1, 1000, len(data)):
+            decoder = nh2.websocket.FrameDecoder(from_client=bool(mask_key))
+            frames = []
+            for i in range(0, len(data), size):
+                frames.extend(decoder.feed(data[i:i + size]))
+            assert frames == [(True, nh2.websocket.BINARY, payload) for payload in payloads
+                             ] + [(False, nh2.websocket.TEXT, b'end')]
+
+
+def test_frame_encoding():
+    """Verify the header and masking against RFC 6455's examples."""
+
+    assert nh2.websocket.encode_frame(nh2.websocket.TEXT, b'Hello') == b'\x81\x05Hello'
+    assert nh2.websocket.encode_frame(
+        nh2.websocket.TEXT, b'Hello',
+        mask_key=b'\x37\xfa\x21\x3d') == b'\x81\x85\x37\xfa\x21\x3d\x7f\x9f\x4d\x51\x58'
+    assert nh2.websocket.encode_frame(nh2.websocket.BINARY, bytes(256))[:4] == b'\x82\x7e\x01\x00'
+
+
+def test_decoder_errors():
+    """Verify oversized, malformed, reserved, and wrongly (un)masked frames are rejected."""
+
+    with pytest.raises(nh2.websocket.WebSocketError):
+        nh2.websocket.FrameDecoder(max_length=3).feed(
+            nh2.websocket.encode_frame(nh2.websocket.BINARY, b'abcd'))
+
+    with pytest.raises(nh2.websocket.WebSocketError):
+        nh2.websocket.FrameDecoder().feed(
+            nh2.websocket.encode_frame(nh2.websocket.PING, b'', fin=False))
+
+    with pytest.raises(nh2.websocket.WebSocketError):
+        nh2.websocket.FrameDecoder().feed(
+            nh2.websocket.encode_frame(nh2.websocket.TEXT, b'hi', mask_key=b'\x01\x02\x03\x04'))
+
+    with pytest.raises(nh2.websocket.WebSocketError):
+        nh2.websocket.FrameDecoder(from_client=True).feed(
+            nh2.websocket.encode_frame(nh2.websocket.TEXT, b'hi'))
+
+    # RSV1 (as if permessage-deflate had been negotiated).
+    with pytest.raises(nh2.websocket.WebSocketError):
+        nh2.websocket.FrameDecoder().feed(b'\xc1\x02hi')
+
+    assert nh2.websocket.parse_close(b'').code == 1005
+    closed = nh2.websocket.parse_close(b'\x0f\xa0bye')
+    assert (closed.code, closed.reason) == (4000, 'bye')
+    for payload in (b'\x03', b'\x03\xed', b'\x03\xee', b'\x07\xd0', b'\x13\x88', b'\x03\xe8\xff'):
+        with pytest.raises(nh2.websocket.WebSocketError):
+            nh2.websocket.parse_close(payload)
+
+
+async def test_unsupported():
+    """Verify a server that doesn't advertise extended CONNECT is never sent one."""
+
+    async with nh2.mock.expect_connect('example.com', 443) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    with pytest.raises(nh2.connection.ExtendedConnectUnsupported):
+        await nh2.websocket.connect(conn, '/chat')
+    assert not conn.streams
+    assert 'RequestReceived' not in await mock_server.read()
+
+
+async def _receive_frames(mock_server, decoder):
+    frames = []
+    while not frames:
+        for event in mock_server.c.receive_data(await mock_server.s.receive()):
+            if isinstance(event, h2.events.DataReceived):
+                frames.extend(decoder.feed(event.data))
+                mock_server.c.acknowledge_received_data(event.flow_controlled_length, 1)
+        await mock_server.flush()
+    return frames
+
+
+async def test_websocket():
+    """Verify the handshake, messages in both directions, pings, and the closing handshake."""
+
+    settings = {h2.settings.SettingCodes.ENABLE_CONNECT_PROTOCOL: 1}
+    async with nh2.mock.expect_connect('example.com', 443, settings=settings) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        connect = functools.partial(nh2.websocket.connect, subprotocols=('chat', 'v2'))
+        future = tg.start_soon(connect, conn, '/chat')
+
+        assert 'RemoteSettingsChanged' in await mock_server.read()
+        assert 'SettingsAcknowledged' in await mock_server.read()
+        assert await mock_server.read() == """
+          - [RequestReceived]
+            stream_id: 1
+            headers:
+              - (':method', 'CONNECT')
+              - (':path', '/chat')
+              - (':authority', 'example.com')
+              - (':scheme', 'https')
+              - (':protocol', 'websocket')
+              - ('sec-websocket-version', '13')
+              - ('sec-websocket-protocol', 'chat, v2')
+            stream_ended: None
+            priority_updated: None
+        """
+        mock_server.c.send_headers(1, [(':status', '200'), ('sec-websocket-protocol', 'chat')])
+        await mock_server.flush()
+        ws = await future
+
+    assert ws.subprotocol == 'chat'
+    decoder = nh2.websocket.FrameDecoder(from_client=True)
+
+    await ws.send('hello')
+    await ws.send(b'\x00\x01')
+    frames = await _receive_frames(mock_server, decoder)
+    if len(frames) == 1:
+        frames += await _receive_frames(mock_server, decoder)
+    assert frames == [(True, nh2.websocket.TEXT, b'hello'),
+                      (True, nh2.websocket.BINARY, b'\x00\x01')]
+
+    mock_server.c.send_data(
+        1,
+        nh2.websocket.encode_frame(nh2.websocket.TEXT, b'hi ', fin=False) +
+        nh2.websocket.encode_frame(nh2.websocket.PING, b'p') +
+        nh2.websocket.encode_frame(nh2.websocket.CONTINUATION, b'there') +
+        nh2.websocket.encode_frame(nh2.websocket.BINARY, b'\xff'))
+    await mock_server.flush()
+    assert await ws.receive() == 'hi there'
+    assert await ws.receive() == b'\xff'
+    assert await _receive_frames(mock_server, decoder) == [(True, nh2.websocket.PONG, b'p')]
+
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(ws.close, 1000, 'bye')
+        assert await _receive_frames(mock_server,
+                                     decoder) == [(True, nh2.websocket.CLOSE, b'\x03\xe8bye')]
+        mock_server.c.send_data(1, nh2.websocket.encode_frame(nh2.websocket.CLOSE, b'\x03\xe8'))
+        mock_server.c.end_stream(1)
+        await mock_server.flush()
+        await future
+
+    assert ws.closed.code == 1000
+    assert not conn.streams
+    with pytest.raises(nh2.websocket.ConnectionClosed):
+        await ws.send('too late')
+
+
+async def _accept(mock_server, conn, stream_id, **kwargs):
+    async with nh2.anyio_util.create_task_group() as tg:
+        future = tg.start_soon(functools.partial(nh2.websocket.connect, **kwargs), conn, '/chat')
+        while 'RequestReceived' not in await mock_server.read():
+            pass
+        mock_server.c.send_headers(stream_id, [(':status', '200')])
+        await mock_server.flush()
+        return await future
+
+
+async def test_invalid_messages():
+    """Verify fragmented messages are limited as a whole, and text messages must be UTF-8."""
+
+    settings = {h2.settings.SettingCodes.ENABLE_CONNECT_PROTOCOL: 1}
+    async with nh2.mock.expect_connect('example.com', 443, settings=settings) as mock_server:
+        conn = await nh2.connection.Connection('example.com', 443)
+
+    # Each frame fits within max_length, but the message as a whole doesn't.
+    ws = await _accept(mock_server, conn, 1, max_length=5)
+    mock_server.c.send_data(
+        1,
+        nh2.websocket.encode_frame(nh2.websocket.BINARY, b'abc', fin=False) +
+        nh2.websocket.encode_frame(nh2.websocket.CONTINUATION, b'def'))
+    await mock_server.flush()
+    with pytest.raises(nh2.websocket.WebSocketError):
+        await ws.receive()
+
+    ws = await _accept(mock_server, conn, 3)
+    mock_server.c.send_data(3, nh2.websocket.encode_frame(nh2.websocket.TEXT, b'\xff'))
+    await mock_server.flush()
+    with pytest.raises(nh2.websocket.WebSocketError):
+        await ws.receive()
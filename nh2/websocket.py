@@ -0,0 +1,278 @@
+"""WebSockets over HTTP/2 (RFC 8441), each carried by one Stream of a shared Connection."""
+
+import collections
+import os
+import struct
+
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xa
+
+_SHORT = struct.Struct('>BB')
+_MEDIUM = struct.Struct('>BBH')
+_LONG = struct.Struct('>BBQ')
+
+# The close codes an endpoint may actually send (RFC 6455 section 7.4), besides 3000-4999 (which are
+# for libraries and applications).
+_CLOSE_CODES = frozenset((1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 1012, 1013, 1014))
+
+
+class WebSocketError(Exception):
+    """The server refused the WebSocket, or broke the protocol."""
+
+
+class ConnectionClosed(Exception):
+    """The WebSocket has been closed (1006 means it ended without a close frame)."""
+
+    def __init__(self, code, reason=''):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
+
+
+def _mask(payload, key):
+    # XOR the whole payload as one big integer, which is far faster than going byte by byte.
+    length = len(payload)
+    if not length:
+        return b''
+    keys = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(keys, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(opcode, payload, *, fin=True, mask_key=None):
+    """Return a frame carrying payload, masked with mask_key (4 bytes) if given."""
+
+    first = opcode | (0x80 if fin else 0)
+    masked = 0x80 if mask_key else 0
+    length = len(payload)
+    if length < 126:
+        header = _SHORT.pack(first, masked | length)
+    elif length < 0x10000:
+        header = _MEDIUM.pack(first, masked | 126, length)
+    else:
+        header = _LONG.pack(first, masked | 127, length)
+    if mask_key:
+        return header + mask_key + _mask(payload, mask_key)
+    return header + payload
+
+
+def parse_close(payload):
+    """Return a ConnectionClosed for a close frame's payload (or raise WebSocketError)."""
+
+    if not payload:
+        return ConnectionClosed(1005)
+    if len(payload) == 1:
+        raise WebSocketError('Received a close frame with a 1-byte payload')
+    code = struct.unpack('>H', payload[:2])[0]
+    if code not in _CLOSE_CODES and not 3000 <= code < 5000:
+        raise WebSocketError(f'Received a close frame with invalid code {code}')
+    try:
+        return ConnectionClosed(code, payload[2:].decode('utf8'))
+    except UnicodeDecodeError as e:
+        raise WebSocketError('Received a close frame whose reason is not valid UTF-8') from e
+
+
+class FrameDecoder:
+    """Incrementally split a byte stream into (fin, opcode, payload) frames.
+
+    Frames from a server must not be masked, and frames from a client (from_client=True) must be
+    (RFC 6455 section 5.1); either mistake is a WebSocketError.
+    """
+
+    def __init__(self, *, max_length=16 * 1024 * 1024, from_client=False):
+        self.max_length = max_length
+        self.from_client = from_client
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Return a list of the frames completed by data."""
+
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        while len(buffer) - pos >= _SHORT.size:
+            first, second = _SHORT.unpack_from(buffer, pos)
+            length = second & 0x7f
+            start = pos + _SHORT.size
+            if length == 126:
+                if len(buffer) < pos + _MEDIUM.size:
+                    break
+                length = _MEDIUM.unpack_from(buffer, pos)[2]
+                start = pos + _MEDIUM.size
+            elif length == 127:
+                if len(buffer) < pos + _LONG.size:
+                    break
+                length = _LONG.unpack_from(buffer, pos)[2]
+                start = pos + _LONG.size
+            self._check_header(first, second, length)
+            key = None
+            if second & 0x80:
+                key = bytes(buffer[start:start + 4])
+                start += 4
+            end = start + length
+            if len(buffer) < end:
+                break
+            payload = bytes(buffer[start:end])
+            if key:
+                payload = _mask(payload, key)
+            frames.append((bool(first & 0x80), first & 0x0f, payload))
+            pos = end
+        if pos:
+            del buffer[:pos]
+        return frames
+
+    def _check_header(self, first, second, length):
+        if length > self.max_length:
+            raise WebSocketError(f'Frame of {length} bytes exceeds limit of {self.max_length}')
+        if first & 0x70:
+            raise WebSocketError('Received a frame with reserved bits set (with no extension)')
+        opcode = first & 0x0f
+        if opcode >= CLOSE and (length > 125 or not first & 0x80):
+            raise WebSocketError(f'Invalid control frame (opcode {opcode:#x})')
+        masked = bool(second & 0x80)
+        if masked != self.from_client:
+            raise WebSocketError(f'Received a {"masked" if masked else "unmasked"} frame from the '
+                                 f'{"client" if self.from_client else "server"}')
+
+
+class WebSocket:  # pylint: disable=too-many-instance-attributes
+    """A WebSocket tunneled through an extended-CONNECT Stream.
+
+    Any number of tasks may send at once, but only one should receive at a time. Received data is
+    only acknowledged to the server as it's consumed, so a slow receiver makes the server stop
+    sending rather than making us buffer without limit.
+    """
+
+    def __init__(self, stream, *, max_length=16 * 1024 * 1024):
+        self.stream = stream
+        self.subprotocol = stream.received_headers.get('sec-websocket-protocol')
+        self.max_length = max_length
+        self.decoder = FrameDecoder(max_length=max_length)
+        self.chunks = stream.iter_data()
+        self.messages = collections.deque()
+        self.fragments = []
+        self.fragments_length = 0
+        self.fragments_opcode = None
+        self.close_sent = False
+        self.closed = None
+
+    async def send(self, message):
+        """Send message (as a text message if it's a str, otherwise as a binary message)."""
+
+        if isinstance(message, str):
+            await self._send_frame(TEXT, message.encode('utf8'))
+        else:
+            await self._send_frame(BINARY, bytes(message))
+
+    async def ping(self, payload=b''):
+        """Send a ping (the server's pong is consumed by receive)."""
+
+        await self._send_frame(PING, payload)
+
+    async def _send_frame(self, opcode, payload):
+        if self.close_sent:
+            raise self.closed or ConnectionClosed(1006)
+        # Stream.write doesn't return until the whole frame has fit through the flow-control window.
+        await self.stream.write(encode_frame(opcode, payload, mask_key=os.urandom(4)))
+
+    async def receive(self):
+        """Return the next message (a str or bytes), or raise ConnectionClosed."""
+
+        while not self.messages:
+            if self.closed:
+                raise self.closed
+            try:
+                chunk = await self.chunks.__anext__()  # pylint: disable=unnecessary-dunder-call
+            except StopAsyncIteration:
+                self.closed = self.closed or ConnectionClosed(1006)
+                continue
+            for fin, opcode, payload in self.decoder.feed(chunk):
+                await self._receive_frame(fin, opcode, payload)
+        return self.messages.popleft()
+
+    async def _receive_frame(self, fin, opcode, payload):
+        if self.closed:
+            return
+        if opcode == PING:
+            if not self.close_sent:
+                await self._send_frame(PONG, payload)
+        elif opcode == PONG:
+            pass
+        elif opcode == CLOSE:
+            self.closed = parse_close(payload)
+            if not self.close_sent:
+                await self._send_close(payload[:2])
+        else:
+            self._receive_fragment(fin, opcode, payload)
+
+    def _receive_fragment(self, fin, opcode, payload):
+        if opcode == CONTINUATION:
+            if self.fragments_opcode is None:
+                raise WebSocketError('Received a continuation frame with no message to continue')
+        elif self.fragments_opcode is not None:
+            raise WebSocketError('Received a new message in the middle of a fragmented one')
+        else:
+            self.fragments_opcode = opcode
+        # The decoder only limits each frame, so a message split across many frames is limited here.
+        self.fragments_length += len(payload)
+        if self.fragments_length > self.max_length:
+            raise WebSocketError(f'Fragmented message exceeds limit of {self.max_length}')
+        self.fragments.append(payload)
+        if fin:
+            message = b''.join(self.fragments)
+            if self.fragments_opcode == TEXT:
+                try:
+                    message = message.decode('utf8')
+                except UnicodeDecodeError as e:
+                    raise WebSocketError('Received a text message that is not valid UTF-8') from e
+            self.messages.append(message)
+            self.fragments = []
+            self.fragments_length = 0
+            self.fragments_opcode = None
+
+    async def _send_close(self, payload):
+        await self._send_frame(CLOSE, payload)
+        self.close_sent = True
+        await self.stream.end()
+
+    async def close(self, code=1000, reason=''):
+        """Send a close frame, then wait for the server's (discarding any messages before it)."""
+
+        if not self.close_sent:
+            await self._send_close(struct.pack('>H', code) + reason.encode('utf8'))
+        try:
+            while True:
+                await self.receive()
+        except ConnectionClosed:
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except ConnectionClosed as e:
+            raise StopAsyncIteration from e
+
+
+async def connect(connection, path, *, subprotocols=(), headers=(), max_length=16 * 1024 * 1024):
+    """Open a WebSocket to path over connection (which the server must allow extended CONNECT on).
+
+    Raises nh2.connection.ExtendedConnectUnsupported if it doesn't, or WebSocketError if the server
+    refuses this particular WebSocket.
+    """
+
+    headers = {'sec-websocket-version': '13', **dict(headers)}
+    if subprotocols:
+        headers['sec-websocket-protocol'] = ', '.join(subprotocols)
+    stream = await connection.connect('websocket', path, headers=headers)
+    received_headers = await stream.wait_headers()
+    if not received_headers[':status'].startswith('2'):
+        await stream.cancel()
+        raise WebSocketError(f'Server refused WebSocket with status {received_headers[":status"]}')
+    return WebSocket(stream, max_length=max_length)